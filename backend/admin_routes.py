@@ -1,67 +1,145 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime, timezone
+from flask import Blueprint, Response, current_app, g, request, jsonify, stream_with_context
+from datetime import datetime, timedelta, timezone
 from bson.objectid import ObjectId
-from functools import wraps
-import jwt
-import os
-from email_service import send_status_update_notification
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from outbox import enqueue_email, enqueue_emails
+from pagination import paginate
+from export import EXPORT_FORMATS, EXPORT_BATCH_SIZE
+from stats import get_stats, record_status_change, record_status_changes
+from auth import admin_required
+from database import db
+from conditional import tracking_cache, compute_etag, conditional_response
+from search import search_complaints
+from complaints import parse_incident_date
+from analytics import DIMENSIONS, parse_window, top_n, route_timeseries
+from archive import OutdatedComplaint, complaint_collections, find_complaint, merged_find, restore
+from bulk_status import MAX_BULK_STATUS_UPDATE, select_by_ids, select_by_filter, apply_status, coalesce_notifications
+from geo import area_query, heatmap_tile, tile_cache
+from history import GROUPS, history_entry, record_transitions, timeline, time_in_status
+import events
 
 admin = Blueprint('admin', __name__)
 
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'No authorization token provided'}), 401
-        
-        token = auth_header.split(' ')[1]
-        try:
-            payload = jwt.decode(token, os.getenv('JWT_SECRET_KEY'), algorithms=['HS256'])
-            if payload.get('role') != 'admin':
-                return jsonify({'error': 'Admin access required'}), 403
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
-        
-        return f(*args, **kwargs)
-    return decorated
+def build_complaint_query(args):
+    """Build the complaints filter from the status/type/date query parameters."""
+    # Get query parameters for filtering
+    status = args.get('status')
+    complaint_type = args.get('type')
+    start_date = args.get('startDate')
+    end_date = args.get('endDate')
+    
+    # Build query
+    query = {}
+    if status:
+        query['status'] = status
+    if complaint_type:
+        query['complaintType'] = complaint_type
+    if start_date and end_date:
+        # Incident dates are stored as midnight UTC; the end date is inclusive
+        query['incident_date'] = {
+            '$gte': parse_incident_date(start_date),
+            '$lt': parse_incident_date(end_date) + timedelta(days=1)
+        }
+    return query
 
 @admin.route('/complaints', methods=['GET'])
 @admin_required
 def get_all_complaints():
     try:
-        from app import db
+        # Fetch one page of complaints with filters, from the archive too if asked
+        try:
+            query = build_complaint_query(request.args)
+            complaints, next_cursor = paginate(complaint_collections(db, request.args), query, request.args)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+        
+        return jsonify({'complaints': complaints, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/complaints/search', methods=['GET'])
+@admin_required
+def search_complaints_view():
+    try:
+        q = request.args.get('q', '').strip()
+        if not q:
+            return jsonify({'error': 'Search query is required', 'details': 'Pass the keywords as q'}), 400
         
-        # Get query parameters for filtering
-        status = request.args.get('status')
+        try:
+            # From the archive too if asked, like the listing
+            hits, next_cursor = search_complaints(complaint_collections(db, request.args), q,
+                                                  build_complaint_query(request.args), request.args)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+        
+        return jsonify({'complaints': hits, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/complaints/geo', methods=['GET'])
+@admin_required
+def get_complaints_in_area():
+    try:
+        # Within radius meters of lat/lng, or inside bbox; the listing filters still apply
+        try:
+            query = {**build_complaint_query(request.args), **area_query(request.args)}
+            complaints, next_cursor = paginate(complaint_collections(db, request.args), query, request.args)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+        
+        return jsonify({'complaints': complaints, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/complaints/heatmap/<int:zoom>/<int:x>/<int:y>', methods=['GET'])
+@admin_required
+def get_heatmap_tile(zoom, x, y):
+    try:
         complaint_type = request.args.get('type')
-        start_date = request.args.get('startDate')
-        end_date = request.args.get('endDate')
-        
-        # Build query
-        query = {}
-        if status:
-            query['status'] = status
-        if complaint_type:
-            query['complaintType'] = complaint_type
-        if start_date and end_date:
-            start = datetime.strptime(start_date, '%Y-%m-%d').replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=timezone.utc)
-            end = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999, tzinfo=timezone.utc)
-            query['date'] = {
-                '$gte': start.isoformat(),
-                '$lte': end.isoformat()
-            }
-        
-        # Fetch complaints with filters
-        complaints = list(db.complaints.find(query).sort('created_at', -1))
-        
-        # Convert ObjectId to string for JSON serialization
-        for complaint in complaints:
-            complaint['_id'] = str(complaint['_id'])
+        cached = tile_cache.get((zoom, x, y), complaint_type)
+        if cached is None:
+            try:
+                body = current_app.json.dumps_bytes(heatmap_tile(db, zoom, x, y, complaint_type))
+            except ValueError as e:
+                return jsonify({'error': 'Invalid tile', 'details': str(e)}), 400
+            cached = (compute_etag(body), body)
+            tile_cache.put((zoom, x, y), complaint_type, *cached)
         
-        return jsonify(complaints)
+        return conditional_response(*cached)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/complaints/export', methods=['GET'])
+@admin_required
+def export_complaints():
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({
+                'error': 'Invalid export format',
+                'details': f'Supported formats: {", ".join(EXPORT_FORMATS)}'
+            }), 400
+        
+        try:
+            query = build_complaint_query(request.args)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+        cursor = merged_find(complaint_collections(db, request.args), query, batch_size=EXPORT_BATCH_SIZE)
+        
+        # Stream rows straight from the cursor, one batch at a time
+        generate, mimetype = EXPORT_FORMATS[export_format]
+        filename = f"complaints-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{export_format}"
+        return Response(
+            stream_with_context(generate(cursor)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -70,8 +148,6 @@ def get_all_complaints():
 @admin_required
 def update_complaint_status(complaint_id):
     try:
-        from app import db
-        
         data = request.get_json()
         if 'status' not in data:
             return jsonify({'error': 'Status is required'}), 400
@@ -79,31 +155,50 @@ def update_complaint_status(complaint_id):
         new_status = data['status']
         remarks = data.get('remarks', '')
         
-        # Update complaint status
-        result = db.complaints.update_one(
-            {'_id': ObjectId(complaint_id)},
-            {
-                '$set': {
-                    'status': new_status,
-                    'remarks': remarks,
-                    'updated_at': datetime.now(timezone.utc).isoformat()
-                }
-            }
-        )
+        changes = {
+            'status': new_status,
+            'remarks': remarks,
+            'updated_at': datetime.utcnow()
+        }
+        
+        # Update complaint status, keeping the previous status for the counters
+        def apply_update():
+            return db.complaints.find_one_and_update(
+                {'_id': ObjectId(complaint_id)},
+                {'$set': changes},
+                projection={'status': 1, 'user_email': 1, 'complaintType': 1, 'routeNumber': 1, 'busNumber': 1,
+                            'created_at': 1},
+                return_document=ReturnDocument.BEFORE
+            )
         
-        if result.modified_count == 0:
+        complaint = apply_update()
+        if complaint is None:
+            # An archived complaint moves back to the live collection before it changes
+            try:
+                if restore(db, ObjectId(complaint_id)):
+                    complaint = apply_update()
+            except DuplicateKeyError:
+                return jsonify({
+                    'error': 'Complaint cannot be reopened',
+                    'details': 'A newer complaint has the same bus, route, type and date'
+                }), 409
+            except OutdatedComplaint as e:
+                return jsonify({'error': 'Complaint cannot be reopened', 'details': str(e)}), 409
+        
+        if complaint is None:
             return jsonify({'error': 'Complaint not found'}), 404
         
-        # Get complaint details for email notification
-        complaint = db.complaints.find_one({'_id': ObjectId(complaint_id)})
-        if complaint:
-            # Send email notification to user
-            send_status_update_notification(
-                complaint['user_email'],
-                complaint_id,
-                new_status,
-                remarks
-            )
+        record_status_change(db, complaint.get('status'), new_status)
+        record_transitions(db, [history_entry(complaint, changes, g.user['email'])])
+        tracking_cache.invalidate(complaint_id)
+        events.complaint_changed({**complaint, **changes})
+        
+        # Queue email notification to user
+        enqueue_email(db, 'status_update', complaint['user_email'], {
+            'tracking_id': complaint_id,
+            'new_status': new_status,
+            'remarks': remarks
+        })
         
         return jsonify({
             'message': 'Complaint status updated successfully',
@@ -113,29 +208,180 @@ def update_complaint_status(complaint_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@admin.route('/complaints/status', methods=['POST'])
+@admin_required
+def bulk_update_complaint_status():
+    try:
+        data = request.get_json()
+        if not data or 'status' not in data:
+            return jsonify({'error': 'Status is required'}), 400
+        
+        ids = data.get('ids')
+        filters = data.get('filter')
+        if (ids is None) == (filters is None):
+            return jsonify({'error': 'Invalid selection', 'details': 'Pass either ids or filter'}), 400
+        
+        new_status = data['status']
+        remarks = data.get('remarks', '')
+        
+        # Select the complaints: explicit ids (archived ones are reopened) or a listing filter
+        if ids is not None:
+            if not isinstance(ids, list) or len(ids) > MAX_BULK_STATUS_UPDATE:
+                return jsonify({
+                    'error': 'Invalid selection',
+                    'details': f'ids must be a list of at most {MAX_BULK_STATUS_UPDATE} complaint ids'
+                }), 400
+            complaints, results = select_by_ids(db, ids)
+        else:
+            try:
+                complaints = select_by_filter(db, build_complaint_query(filters))
+            except (ValueError, AttributeError) as e:
+                return jsonify({'error': 'Invalid filter', 'details': str(e)}), 400
+            results = {}
+        
+        changes, updated = apply_status(db, complaints, new_status, remarks)
+        updated_ids = {complaint['_id'] for complaint in updated}
+        for complaint in complaints:
+            results[str(complaint['_id'])] = 'updated' if complaint['_id'] in updated_ids else 'conflict'
+        
+        record_status_changes(db, [(complaint.get('status'), new_status) for complaint in updated])
+        record_transitions(db, [history_entry(complaint, changes, g.user['email']) for complaint in updated])
+        for complaint in updated:
+            tracking_cache.invalidate(complaint['_id'])
+            events.complaint_changed({**complaint, **changes})
+        
+        # One email per user, however many of their complaints changed
+        enqueue_emails(db, coalesce_notifications(updated, new_status, remarks))
+        
+        return jsonify({
+            'message': f'{len(updated)} complaints updated',
+            'status': new_status,
+            'updated': len(updated),
+            'results': [{'id': complaint_id, 'result': result} for complaint_id, result in results.items()]
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/complaints/<complaint_id>/timeline', methods=['GET'])
+@admin_required
+def get_complaint_timeline(complaint_id):
+    try:
+        try:
+            complaint = find_complaint(db, ObjectId(complaint_id), {'status': 1, 'created_at': 1})
+        except InvalidId:
+            return jsonify({'error': 'Invalid complaint ID format'}), 400
+        if complaint is None:
+            return jsonify({'error': 'Complaint not found'}), 404
+        
+        return jsonify({
+            'tracking_id': complaint_id,
+            'status': complaint.get('status'),
+            'created_at': complaint.get('created_at'),
+            'history': timeline(db, complaint_id)
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/complaints/events', methods=['GET'])
+@admin_required
+def stream_complaint_events():
+    # Optional status/type/route filters narrow the firehose
+    try:
+        stream = events.broker.stream('admin', events.admin_filter(request.args),
+                                      request.headers.get('Last-Event-ID'))
+    except events.StreamsBusy:
+        return events.busy_response()
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @admin.route('/complaints/stats', methods=['GET'])
 @admin_required
 def get_complaint_stats():
     try:
-        from app import db
+        # Read the materialized counters (O(1), cached in-process)
+        stats = get_stats(db)
         
-        # Get total complaints count
-        total_complaints = db.complaints.count_documents({})
+        def distribution(counts):
+            return [{'_id': key, 'count': count} for key, count in counts.items() if count]
         
-        # Get complaints count by status
-        status_counts = list(db.complaints.aggregate([
-            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
-        ]))
+        return jsonify({
+            'total_complaints': stats.get('total', 0),
+            'status_distribution': distribution(stats.get('by_status', {})),
+            'type_distribution': distribution(stats.get('by_type', {})),
+            'daily_distribution': distribution(stats.get('by_day', {}))
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/analytics/top', methods=['GET'])
+@admin_required
+def get_top_hotspots():
+    try:
+        dimension = request.args.get('dimension', 'route')
+        if dimension not in DIMENSIONS:
+            return jsonify({'error': 'Invalid dimension', 'details': 'Use route or bus'}), 400
+        try:
+            start_day, end_day = parse_window(request.args.get('start'), request.args.get('end'))
+            limit = min(int(request.args.get('limit', 10)), 100)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+        
+        return jsonify({
+            'dimension': dimension,
+            'start': start_day.strftime('%Y-%m-%d'),
+            'end': end_day.strftime('%Y-%m-%d'),
+            'results': top_n(db, dimension, start_day, end_day, limit, request.args.get('type'))
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/analytics/time-in-status', methods=['GET'])
+@admin_required
+def get_time_in_status():
+    try:
+        from_status = request.args.get('from', 'pending')
+        to_status = request.args.get('to', 'resolved')
+        group = request.args.get('group', 'route')
+        if group not in GROUPS:
+            return jsonify({'error': 'Invalid group', 'details': 'Use route, bus or type'}), 400
+        try:
+            start_day, end_day = parse_window(request.args.get('start'), request.args.get('end'))
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
         
-        # Get complaints count by type
-        type_counts = list(db.complaints.aggregate([
-            {'$group': {'_id': '$complaintType', 'count': {'$sum': 1}}}
-        ]))
+        return jsonify({
+            'from': from_status,
+            'to': to_status,
+            'group': group,
+            'start': start_day.strftime('%Y-%m-%d'),
+            'end': end_day.strftime('%Y-%m-%d'),
+            'results': time_in_status(db, from_status, to_status, start_day, end_day, group,
+                                      request.args.get('type'))
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin.route('/analytics/routes/<route_number>/timeseries', methods=['GET'])
+@admin_required
+def get_route_timeseries(route_number):
+    try:
+        interval = request.args.get('interval', 'day')
+        if interval not in ('day', 'week'):
+            return jsonify({'error': 'Invalid interval', 'details': 'Use day or week'}), 400
+        try:
+            start_day, end_day = parse_window(request.args.get('start'), request.args.get('end'))
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
         
         return jsonify({
-            'total_complaints': total_complaints,
-            'status_distribution': status_counts,
-            'type_distribution': type_counts
+            'routeNumber': route_number,
+            'interval': interval,
+            'series': route_timeseries(db, route_number, start_day, end_day, interval, request.args.get('type'))
         })
     
     except Exception as e:
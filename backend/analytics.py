@@ -0,0 +1,160 @@
+"""Daily complaint rollups for route and bus hotspot analytics.
+
+``complaint_rollups`` holds one counter per (day, routeNumber, busNumber,
+complaintType), where day is the incident date reported by the user.
+Submissions ``$inc`` the matching counters; the analytics endpoints only
+ever read this collection, so their cost depends on the window size and not
+on the number of raw complaints.
+
+    python analytics.py --rebuild   # recompute the rollups in batches
+"""
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from indexes import INDEXES
+from archive import ARCHIVE_COLLECTION
+
+ROLLUP_COLLECTION = 'complaint_rollups'
+REBUILD_BATCH_SIZE = 10000
+DIMENSIONS = {'route': 'routeNumber', 'bus': 'busNumber'}
+
+
+def rollup_day(complaint):
+    """Incident day for a complaint, falling back to its creation day."""
+    day = complaint.get('incident_date')
+    if not isinstance(day, datetime):
+        try:
+            day = datetime.strptime(complaint.get('date', ''), '%Y-%m-%d')
+        except (TypeError, ValueError):
+            day = complaint['created_at']
+    return datetime(day.year, day.month, day.day)
+
+
+def _rollup_counts(complaints):
+    counts = {}
+    for complaint in complaints:
+        key = (rollup_day(complaint), str(complaint['routeNumber']),
+               str(complaint['busNumber']), str(complaint['complaintType']))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def _apply_counts(collection, counts):
+    if not counts:
+        return
+    collection.bulk_write([
+        UpdateOne(
+            {'day': day, 'routeNumber': route, 'busNumber': bus, 'complaintType': complaint_type},
+            {'$inc': {'count': count}},
+            upsert=True
+        )
+        for (day, route, bus, complaint_type), count in counts.items()
+    ], ordered=False)
+
+
+def record_rollups(db, complaints):
+    """Add newly inserted complaints to the daily rollups."""
+    _apply_counts(db[ROLLUP_COLLECTION], _rollup_counts(complaints))
+
+
+def rebuild_rollups(db, batch_size=REBUILD_BATCH_SIZE, progress=None):
+    """Recompute every rollup into a scratch collection and swap it in.
+
+    Complaints are read in ``_id`` order, ``batch_size`` at a time, so the
+    rebuild never holds more than one batch in memory. Submissions made while
+    it runs are lost at the swap, so run it during a quiet period.
+    """
+    scratch = db[f'{ROLLUP_COLLECTION}_rebuild']
+    scratch.drop()
+    scratch.create_indexes(INDEXES[ROLLUP_COLLECTION])
+
+    projection = {'date': 1, 'incident_date': 1, 'created_at': 1, 'routeNumber': 1, 'busNumber': 1, 'complaintType': 1}
+    processed = 0
+    for collection in (db.complaints, db[ARCHIVE_COLLECTION]):
+        last_id = None
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id else {}
+            batch = list(collection.find(query, projection).sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            _apply_counts(scratch, _rollup_counts(
+                c for c in batch if all(c.get(f) is not None for f in ('routeNumber', 'busNumber', 'complaintType'))
+            ))
+            processed += len(batch)
+            last_id = batch[-1]['_id']
+            if progress:
+                progress(processed)
+
+    if processed:
+        scratch.rename(ROLLUP_COLLECTION, dropTarget=True)
+    else:
+        scratch.drop()
+        db[ROLLUP_COLLECTION].delete_many({})
+    return processed
+
+
+def parse_window(start, end, default_days=28):
+    """Parse YYYY-MM-DD bounds into an inclusive ``(start, end)`` day range."""
+    end_day = datetime.strptime(end, '%Y-%m-%d') if end else datetime.utcnow().replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    start_day = datetime.strptime(start, '%Y-%m-%d') if start else end_day - timedelta(days=default_days - 1)
+    if start_day > end_day:
+        raise ValueError('start must not be after end')
+    return start_day, end_day
+
+
+def top_n(db, dimension, start_day, end_day, limit=10, complaint_type=None):
+    """Routes or buses with the most complaints in the window."""
+    field = DIMENSIONS[dimension]
+    match = {'day': {'$gte': start_day, '$lte': end_day}}
+    if complaint_type:
+        match['complaintType'] = complaint_type
+    group_id = {'routeNumber': '$routeNumber', 'busNumber': '$busNumber'} if field == 'busNumber' else '$routeNumber'
+    rows = db[ROLLUP_COLLECTION].aggregate([
+        {'$match': match},
+        {'$group': {'_id': group_id, 'count': {'$sum': '$count'}}},
+        {'$sort': {'count': -1}},
+        {'$limit': limit}
+    ])
+    if field == 'busNumber':
+        return [{'busNumber': r['_id']['busNumber'], 'routeNumber': r['_id']['routeNumber'],
+                 'count': r['count']} for r in rows]
+    return [{'routeNumber': r['_id'], 'count': r['count']} for r in rows]
+
+
+def route_timeseries(db, route_number, start_day, end_day, interval='day', complaint_type=None):
+    """Complaint counts for one route per day or per ISO week (weeks start on Monday)."""
+    match = {'routeNumber': route_number, 'day': {'$gte': start_day, '$lte': end_day}}
+    if complaint_type:
+        match['complaintType'] = complaint_type
+    rows = db[ROLLUP_COLLECTION].aggregate([
+        {'$match': match},
+        {'$group': {'_id': '$day', 'count': {'$sum': '$count'}}}
+    ])
+
+    buckets = {}
+    for row in rows:
+        bucket = row['_id']
+        if interval == 'week':
+            bucket -= timedelta(days=bucket.weekday())
+        buckets[bucket] = buckets.get(bucket, 0) + row['count']
+
+    # Emit every bucket in the window, including empty ones
+    step = timedelta(days=7 if interval == 'week' else 1)
+    bucket = start_day - timedelta(days=start_day.weekday()) if interval == 'week' else start_day
+    series = []
+    while bucket <= end_day:
+        series.append({'period': bucket.strftime('%Y-%m-%d'), 'count': buckets.get(bucket, 0)})
+        bucket += step
+    return series
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    if '--rebuild' not in sys.argv:
+        print('Usage: python analytics.py --rebuild')
+        sys.exit(1)
+    db = get_db()
+    total = rebuild_rollups(db, progress=lambda n: print(f'Processed {n} complaints'))
+    print(f'Rebuilt rollups from {total} complaints')
@@ -1,15 +1,40 @@
-from flask import Flask, request, jsonify
+import time
+
+# Measured from here to the first request each worker serves
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Blueprint, Response, current_app, g, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
+import json
 import jwt
-from datetime import datetime, timedelta
-from pymongo import MongoClient
-from passlib.hash import pbkdf2_sha256
-from email_validator import validate_email, EmailNotValidError
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from passwords import hash_password, verify_password, schedule_rehash, busy_response, HasherBusy
+from email_validator import EmailNotValidError
+from email_validation import validate_syntax, check_domain, flag_if_undeliverable
 from admin_routes import admin
 from password_reset import generate_reset_token, verify_reset_token, update_password
-from email_templates.password_reset import send_password_reset_email
+from outbox import enqueue_email, start_workers
+from indexes import ensure_indexes
+from pagination import paginate, parse_fields
+from stats import record_submission, record_submissions
+from analytics import record_rollups
+from geo import record_locations
+from auth import login_required
+from ratelimit import rate_limited
+from attachments import receive_complaint_form, discard_uploads, download_response
+from archive import find_complaint
+from complaints import (REQUIRED_FIELDS, INTERNAL_FIELDS, MAX_BATCH_SIZE, batch_notification, build_complaint,
+                        ensure_schema, find_existing, ingest_batch)
+from database import db
+import metrics
+import events
+from json_provider import MongoJSONProvider
+from conditional import compute_etag, conditional_response, not_modified, tracking_cache, version_parts
 
 # Load environment variables
 load_dotenv()
@@ -22,40 +47,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
-
-# Register blueprints
-app.register_blueprint(admin, url_prefix='/api/admin')
-
-# MongoDB connection
-try:
-    client = MongoClient(os.getenv('MONGODB_URI'))
-    # Test the connection
-    client.admin.command('ping')
-    db = client.complaint_system  # Changed to match the database name in connection string
-    print('Successfully connected to MongoDB')
-    # Verify collections exist or create them
-    if 'users' not in db.list_collection_names():
-        db.create_collection('users')
-        print('Created users collection')
-    if 'complaints' not in db.list_collection_names():
-        db.create_collection('complaints')
-        print('Created complaints collection')
-except Exception as e:
-    print(f'Error connecting to MongoDB: {str(e)}')
-    print('Please ensure:')
-    print('1. MongoDB service is running (it is)')
-    print('2. MongoDB is listening on localhost:27017')
-    print('3. No authentication is required for local development')
-    raise
-
 # JWT configuration
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 
+# Reverse proxies in front of the app (e.g. 1 for nginx) whose X-Forwarded-For/-Proto to trust
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+
+api = Blueprint('api', __name__)
+
+_worker_pid = None
+
+
+def _start_worker_process():
+    """Per-process startup, run on the first request after any fork.
+
+    Threads do not survive fork(), so the outbox workers and any change
+    stream relay are started here rather than at import (set
+    OUTBOX_WORKERS=0 when a separate outbox process runs).
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    start_workers(db)
+    events.start(db)
+    logger.info(f'Worker {_worker_pid} serving first request '
+                f'{(time.perf_counter() - IMPORT_STARTED) * 1000:.1f} ms after import')
+
+
+def create_app():
+    """Build the Flask application. Does no network I/O."""
+    app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
+    CORS(app)
+    if TRUSTED_PROXY_HOPS:
+        # request.remote_addr becomes the client, so per-IP rate limits see real clients
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+    
+    # Register blueprints
+    app.register_blueprint(api)
+    app.register_blueprint(admin, url_prefix='/api/admin')
+    app.before_request(_start_worker_process)
+    metrics.init_app(app)
+    return app
+
+
 # Routes
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     try:
         data = request.get_json()
@@ -71,15 +109,22 @@ def register():
                 'details': f'Please provide: {", ".join(missing_fields)}'
             }), 400
         
-        # Validate email format
+        # Validate email format inline; domain deliverability comes from cache or a bounded lookup
         try:
-            validate_email(data['email'])
+            email_info = validate_syntax(data['email'])
         except EmailNotValidError as e:
             return jsonify({
                 'error': 'Invalid email format',
                 'details': str(e)
             }), 400
         
+        deliverable, reason = check_domain(email_info.domain)
+        if deliverable is False:
+            return jsonify({
+                'error': 'Invalid email format',
+                'details': reason
+            }), 400
+        
         # Check if user already exists
         if db.users.find_one({'email': data['email']}):
             return jsonify({
@@ -96,7 +141,9 @@ def register():
         
         try:
             # Hash password
-            hashed_password = pbkdf2_sha256.hash(data['password'])
+            hashed_password = hash_password(data['password'])
+        except HasherBusy:
+            return busy_response('registration')
         except Exception as e:
             logger.error(f'Password hashing error: {str(e)}')
             return jsonify({
@@ -118,6 +165,11 @@ def register():
             result = db.users.insert_one(user)
             if not result.inserted_id:
                 raise Exception('Failed to insert user into database')
+        except DuplicateKeyError:
+            return jsonify({
+                'error': 'Email already registered',
+                'details': 'Please use a different email or try logging in'
+            }), 400
         except Exception as e:
             logger.error(f'Database error during registration: {str(e)}')
             return jsonify({
@@ -125,6 +177,9 @@ def register():
                 'details': 'Failed to create user account. Please try again later.'
             }), 500
         
+        if deliverable is None:
+            flag_if_undeliverable(db, data['email'], email_info.domain)
+        
         return jsonify({
             'message': 'User registered successfully',
             'details': 'You can now log in with your email and password'
@@ -137,7 +192,8 @@ def register():
             'details': 'An unexpected error occurred during registration. Please try again later.'
         }), 500
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
+@rate_limited('login')
 def login():
     try:
         data = request.get_json()
@@ -165,11 +221,16 @@ def login():
         
         # Verify password
         try:
-            if not pbkdf2_sha256.verify(data['password'], user['password']):
+            matches, needs_rehash = verify_password(data['password'], user['password'])
+            if not matches:
                 return jsonify({
                     'error': 'Authentication failed',
                     'details': 'Incorrect password. Please try again or use the password reset option.'
                 }), 401
+            if needs_rehash:
+                schedule_rehash(db, user['_id'], data['password'], user['password'])
+        except HasherBusy:
+            return busy_response('sign-in')
         except Exception as e:
             logger.error(f'Password verification error: {str(e)}')
             return jsonify({
@@ -209,7 +270,8 @@ def login():
             'details': 'An unexpected error occurred during login. Our team has been notified. Please try again later.'
         }), 500
 
-@app.route('/api/auth/forgot-password', methods=['POST'])
+@api.route('/api/auth/forgot-password', methods=['POST'])
+@rate_limited('forgot_password')
 def forgot_password():
     try:
         data = request.get_json()
@@ -224,9 +286,8 @@ def forgot_password():
         # Generate reset token
         reset_token = generate_reset_token(data['email'])
 
-        # Send password reset email
-        if not send_password_reset_email(data['email'], reset_token):
-            return jsonify({'error': 'Failed to send password reset email'}), 500
+        # Queue password reset email
+        enqueue_email(db, 'password_reset', data['email'], {'reset_token': reset_token})
 
         return jsonify({'message': 'Password reset instructions sent to your email'}), 200
 
@@ -234,7 +295,7 @@ def forgot_password():
         logger.error(f'Forgot password error: {str(e)}')
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
-@app.route('/api/auth/reset-password', methods=['POST'])
+@api.route('/api/auth/reset-password', methods=['POST'])
 def reset_password():
     try:
         data = request.get_json()
@@ -247,8 +308,11 @@ def reset_password():
             return jsonify({'error': 'Invalid or expired reset token'}), 400
 
         # Update password
-        if not update_password(db, email, data['new_password']):
-            return jsonify({'error': 'Failed to update password'}), 500
+        try:
+            if not update_password(db, email, data['new_password']):
+                return jsonify({'error': 'Failed to update password'}), 500
+        except HasherBusy:
+            return busy_response('password reset')
 
         return jsonify({'message': 'Password updated successfully'}), 200
 
@@ -256,66 +320,70 @@ def reset_password():
         logger.error(f'Reset password error: {str(e)}')
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
-@app.route('/api/complaints', methods=['POST'])
+@api.route('/api/complaints', methods=['POST'])
+@login_required
+@rate_limited('submit_complaint')
 def submit_complaint():
     try:
-        # Get user from JWT token
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'No authorization token provided'}), 401
-        
-        token = auth_header.split(' ')[1]
-        try:
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
-            user_email = payload['email']
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
+        user_email = g.user['email']
 
-        data = request.get_json()
+        # The complaint form posts multipart with optional images, streamed into GridFS
+        uploads = []
+        if request.mimetype == 'multipart/form-data':
+            try:
+                data, uploads = receive_complaint_form(db, request.environ)
+            except HTTPException as e:
+                return jsonify({'error': 'Invalid attachment', 'details': e.description}), e.code
+            except ValueError as e:
+                return jsonify({'error': 'Invalid form data', 'details': str(e)}), 400
+        else:
+            data = request.get_json()
         
         # Validate required fields
-        required_fields = ['busNumber', 'routeNumber', 'complaintType', 'description', 'location', 'date']
-        if not all(key in data for key in required_fields):
+        if not data or not all(key in data for key in REQUIRED_FIELDS):
+            discard_uploads(uploads)
             return jsonify({'error': 'Missing required fields'}), 400
         
-        # Check for duplicate complaints
-        start_of_day = datetime.strptime(data['date'], '%Y-%m-%d').replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + timedelta(days=1)
-        
-        existing_complaint = db.complaints.find_one({
-            'busNumber': data['busNumber'],
-            'routeNumber': data['routeNumber'],
-            'complaintType': data['complaintType'],
-            'created_at': {'$gte': start_of_day, '$lt': end_of_day}
-        })
+        # Create complaint document
+        try:
+            complaint = build_complaint(data, user_email, request.headers.get('Idempotency-Key'))
+        except ValueError as e:
+            discard_uploads(uploads)
+            return jsonify({'error': 'Invalid complaint data', 'details': str(e)}), 400
+        if uploads:
+            complaint['attachments'] = [upload.metadata for upload in uploads]
         
-        if existing_complaint:
+        # Insert complaint; the unique dedupe/idempotency indexes reject duplicates
+        try:
+            result = db.complaints.insert_one(complaint)
+        except DuplicateKeyError:
+            discard_uploads(uploads)
+            existing_complaint, is_retry = find_existing(db, complaint)
+            if is_retry:
+                # Same idempotency key: replay the original submission
+                return jsonify({
+                    'message': 'Complaint submitted successfully',
+                    'tracking_id': str(existing_complaint['_id'])
+                }), 200
             return jsonify({
                 'error': 'Duplicate complaint',
                 'details': 'A similar complaint has already been submitted today for this bus and route',
-                'existing_complaint_id': str(existing_complaint['_id'])
+                'existing_complaint_id': str(existing_complaint['_id']) if existing_complaint else None
             }), 409
-        
-        # Create complaint document
-        complaint = {
-            **data,
-            'user_email': user_email,
-            'status': 'pending',
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
-        }
-        
-        # Insert complaint into database
-        result = db.complaints.insert_one(complaint)
         tracking_id = str(result.inserted_id)
+        record_submission(db, complaint)
+        record_rollups(db, [complaint])
+        record_locations(db, [complaint])
 
-        # Send confirmation email
-        from email_service import send_complaint_confirmation
-        if not send_complaint_confirmation(user_email, tracking_id, data):
+        # Queue confirmation email
+        try:
+            enqueue_email(db, 'complaint_confirmation', user_email, {
+                'tracking_id': tracking_id,
+                'complaint_details': data
+            })
+        except Exception as e:
             # Log the error but don't fail the complaint submission
-            app.logger.error(f'Failed to send confirmation email to {user_email}')
+            current_app.logger.error(f'Failed to queue confirmation email to {user_email}: {str(e)}')
             return jsonify({
                 'message': 'Complaint submitted successfully but email notification failed',
                 'tracking_id': tracking_id
@@ -327,58 +395,155 @@ def submit_complaint():
         }), 201
     
     except Exception as e:
-        app.logger.error(f'Error in submit_complaint: {str(e)}')
+        current_app.logger.error(f'Error in submit_complaint: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/complaints/batch', methods=['POST'])
+@login_required
+@rate_limited('submit_batch')
+def submit_complaints_batch():
+    try:
+        user_email = g.user['email']
+        
+        # Accept a JSON array, {"complaints": [...]} or an NDJSON body
+        try:
+            if request.mimetype == 'application/x-ndjson':
+                items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            else:
+                # A malformed JSON body becomes None and gets the non-empty list error below
+                items = request.get_json(silent=True)
+                if isinstance(items, dict):
+                    items = items.get('complaints')
+        except ValueError:
+            return jsonify({'error': 'Invalid request data', 'details': 'Body is not valid JSON or NDJSON'}), 400
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Invalid request data', 'details': 'Provide a non-empty list of complaints'}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({
+                'error': 'Batch too large',
+                'details': f'A batch may contain at most {MAX_BATCH_SIZE} complaints'
+            }), 413
+        
+        results, inserted = ingest_batch(db, items, user_email)
+        
+        if inserted:
+            record_submissions(db, inserted)
+            record_rollups(db, inserted)
+            record_locations(db, inserted)
+            # One confirmation per request, however many complaints it stored
+            try:
+                enqueue_email(db, *batch_notification(inserted, user_email))
+            except Exception as e:
+                current_app.logger.error(f'Failed to queue batch confirmation email to {user_email}: {str(e)}')
+        
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        return jsonify({'results': results, 'summary': summary}), 200
+    
+    except Exception as e:
+        current_app.logger.error(f'Error in submit_complaints_batch: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/complaints/<tracking_id>', methods=['GET'])
+@api.route('/api/complaints/<tracking_id>', methods=['GET'])
 def track_complaint(tracking_id):
     try:
         from bson.objectid import ObjectId
         
-        # Find complaint
-        complaint = db.complaints.find_one({'_id': ObjectId(tracking_id)})
+        # Serve hot lookups from the in-process cache
+        cached = tracking_cache.get(tracking_id)
+        if cached:
+            etag, body = cached
+            return conditional_response(etag, body)
+        
+        # Find complaint, falling back to the archive for old closed ones; the
+        # endpoint is public, so internal keys stay out of the (cached) body
+        complaint = find_complaint(db, ObjectId(tracking_id), INTERNAL_FIELDS)
         if not complaint:
             return jsonify({'error': 'Complaint not found'}), 404
         
-        # Convert ObjectId to string for JSON serialization
-        complaint['_id'] = str(complaint['_id'])
+        etag = compute_etag(*version_parts(complaint))
+        body = current_app.json.dumps_bytes(complaint)
+        tracking_cache.put(tracking_id, etag, body)
+        return conditional_response(etag, body)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/complaints/<tracking_id>/attachments/<attachment_id>', methods=['GET'])
+def download_attachment(tracking_id, attachment_id):
+    try:
+        from bson.objectid import ObjectId
+        
+        # Like tracking, the complaint's id grants access to its attachments
+        attachment_id = ObjectId(attachment_id)
+        complaint = find_complaint(db, ObjectId(tracking_id), {'attachments': 1})
+        attachment = next((a for a in (complaint or {}).get('attachments', []) if a['id'] == attachment_id), None)
+        if attachment is None:
+            return jsonify({'error': 'Attachment not found'}), 404
         
-        return jsonify(complaint)
+        return download_response(db, attachment)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/complaints/user', methods=['GET'])
+@api.route('/api/complaints/events', methods=['GET'])
+@login_required
+def stream_user_complaint_events():
+    # Status changes to the signed-in user's complaints
+    try:
+        stream = events.broker.stream(f"user:{g.user['email']}",
+                                      last_event_id=request.headers.get('Last-Event-ID'))
+    except events.StreamsBusy:
+        return events.busy_response()
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/api/complaints/user', methods=['GET'])
+@login_required
 def get_user_complaints():
     try:
-        # Get user from JWT token
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({'error': 'No authorization token provided'}), 401
+        user_email = g.user['email']
+
+        query = {'user_email': user_email}
+        
+        def page_etag(complaints, next_cursor):
+            parts = [user_email, request.query_string.decode(), next_cursor]
+            for complaint in complaints:
+                parts.extend(version_parts(complaint))
+            return compute_etag(*parts)
         
-        token = auth_header.split(' ')[1]
+        # Answer polls with 304 after reading only the version fields of the page
         try:
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
-            user_email = payload['email']
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token'}), 401
-
-        # Fetch user's complaints
-        complaints = list(db.complaints.find({'user_email': user_email}).sort('created_at', -1))
+            if request.if_none_match:
+                versions, next_cursor = paginate(db.complaints, query, request.args,
+                                                 projection={'status': 1, 'updated_at': 1, 'created_at': 1})
+                etag = page_etag(versions, next_cursor)
+                if not_modified(etag):
+                    return conditional_response(etag)
+            
+            # Fetch one page of the user's complaints, with the version fields for the ETag
+            fields = parse_fields(request.args.get('fields'))
+            projection = {**fields, 'status': 1, 'updated_at': 1} if fields else None
+            complaints, next_cursor = paginate(db.complaints, query, request.args, projection=projection)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
         
-        # Convert ObjectId to string for JSON serialization
-        for complaint in complaints:
-            complaint['_id'] = str(complaint['_id'])
+        etag = page_etag(complaints, next_cursor)
+        if fields:
+            for complaint in complaints:
+                for field in {'status', 'updated_at'} - fields.keys():
+                    complaint.pop(field, None)
         
-        return jsonify(complaints)
+        return conditional_response(etag, lambda: current_app.json.dumps_bytes(
+            {'complaints': complaints, 'next_cursor': next_cursor}))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Root route
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def index():
     return jsonify({
         'message': 'Welcome to the Bus Complaint System API',
@@ -386,5 +551,10 @@ def index():
         'status': 'running'
     })
 
+app = create_app()
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Create collections, the complaint validator and indexes that do not exist yet
+    ensure_schema(db)
+    ensure_indexes(db)
+    app.run(debug=True, port=5000)
@@ -0,0 +1,154 @@
+"""Hot/cold tiering for complaints.
+
+Complaints in a terminal status that have not changed for
+``ARCHIVE_AFTER_DAYS`` are moved from ``complaints`` to
+``complaints_archive``, so the live collection and its indexes only hold
+open and recent complaints. Tracking falls back to the archive, admin views
+include it on request (``include_archived=true``), and a status update on an
+archived complaint moves it back first.
+
+Each batch is copied with idempotent upserts before the originals are
+deleted, so an interrupted run never loses a complaint and is safe to repeat.
+Only complaints at the current schema version are archived, so a restored
+complaint always passes the collection validator; ``python migrate.py``
+also brings the archive up to date.
+
+    python archive.py            # archive every ARCHIVE_INTERVAL_SECONDS
+    python archive.py --once     # one pass, then exit
+"""
+import heapq
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError, WriteError
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = 'complaints_archive'
+ARCHIVE_STATUSES = [s.strip() for s in os.getenv('ARCHIVE_STATUSES', 'resolved,rejected,closed').split(',') if s.strip()]
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+ARCHIVE_PAUSE_MS = int(os.getenv('ARCHIVE_PAUSE_MS', 200))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', 3600))
+
+DOCUMENT_VALIDATION_FAILURE = 121
+
+
+class OutdatedComplaint(Exception):
+    """Raised when an archived complaint predates the current schema and cannot be restored."""
+
+
+def include_archived(args):
+    return args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def complaint_collections(db, args):
+    """The collections an admin view should read for these query parameters."""
+    if include_archived(args):
+        return [db.complaints, db[ARCHIVE_COLLECTION]]
+    return [db.complaints]
+
+
+def merged_find(collections, query, sort_key='created_at', batch_size=100):
+    """Stream ``query`` from several collections, newest ``sort_key`` first."""
+    cursors = [collection.find(query).sort(sort_key, -1).batch_size(batch_size) for collection in collections]
+    if len(cursors) == 1:
+        return cursors[0]
+    return heapq.merge(*cursors, key=lambda document: document[sort_key], reverse=True)
+
+
+def find_complaint(db, complaint_id, projection=None):
+    """Look a complaint up in the live collection, then in the archive."""
+    complaint = db.complaints.find_one({'_id': complaint_id}, projection)
+    if complaint is None:
+        complaint = db[ARCHIVE_COLLECTION].find_one({'_id': complaint_id}, projection)
+    return complaint
+
+
+def restore(db, complaint_id):
+    """Move an archived complaint back to the live collection.
+
+    Returns False if it is not archived. Raises DuplicateKeyError if a live
+    complaint has since taken its dedupe or idempotency key, and
+    OutdatedComplaint if it fails the schema validator.
+    """
+    complaint = db[ARCHIVE_COLLECTION].find_one({'_id': complaint_id})
+    if complaint is None:
+        return False
+    complaint.pop('archived_at', None)
+    try:
+        db.complaints.insert_one(complaint)
+    except DuplicateKeyError:
+        if not db.complaints.find_one({'_id': complaint_id}, {'_id': 1}):
+            raise
+    except WriteError as e:
+        if e.code != DOCUMENT_VALIDATION_FAILURE:
+            raise
+        raise OutdatedComplaint(f'Archived complaint {complaint_id} needs "python migrate.py" before it can change')
+    db[ARCHIVE_COLLECTION].delete_one({'_id': complaint_id})
+    return True
+
+
+def archive_batch(db, cutoff, schema_version, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive up to ``batch_size`` eligible complaints at ``schema_version``; returns how many moved."""
+    eligible = {'status': {'$in': ARCHIVE_STATUSES}, 'updated_at': {'$lt': cutoff},
+                'schema_version': schema_version}
+    batch = list(db.complaints.find(eligible).sort('updated_at', 1).limit(batch_size))
+    if not batch:
+        return 0
+
+    archived_at = datetime.utcnow()
+    db[ARCHIVE_COLLECTION].bulk_write([
+        ReplaceOne({'_id': complaint['_id']}, {**complaint, 'archived_at': archived_at}, upsert=True)
+        for complaint in batch
+    ], ordered=False)
+
+    ids = [complaint['_id'] for complaint in batch]
+    # Re-check eligibility: a complaint reopened meanwhile stays live
+    moved = db.complaints.delete_many({'_id': {'$in': ids}, **eligible}).deleted_count
+    if moved < len(ids):
+        still_live = [c['_id'] for c in db.complaints.find({'_id': {'$in': ids}}, {'_id': 1})]
+        db[ARCHIVE_COLLECTION].delete_many({'_id': {'$in': still_live}})
+    return moved
+
+
+def archive_pass(db, schema_version, after_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                 pause_ms=ARCHIVE_PAUSE_MS, progress=None):
+    """Archive everything eligible now, in throttled batches. Returns the total moved."""
+    cutoff = datetime.utcnow() - timedelta(days=after_days)
+    total = 0
+    while True:
+        moved = archive_batch(db, cutoff, schema_version, batch_size)
+        if not moved:
+            return total
+        total += moved
+        if progress:
+            progress(total)
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import get_db
+    from complaints import SCHEMA_VERSION
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Move old closed complaints to the archive')
+    parser.add_argument('--once', action='store_true', help='run one pass and exit')
+    parser.add_argument('--after-days', type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--pause-ms', type=int, default=ARCHIVE_PAUSE_MS)
+    args = parser.parse_args()
+
+    db = get_db()
+    while True:
+        moved = archive_pass(db, SCHEMA_VERSION, args.after_days, args.batch_size, args.pause_ms,
+                             progress=lambda n: logger.info(f'Archived {n} complaints'))
+        logger.info(f'Archive pass finished: {moved} complaints moved')
+        if args.once:
+            break
+        time.sleep(ARCHIVE_INTERVAL_SECONDS)
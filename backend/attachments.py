@@ -0,0 +1,275 @@
+"""Complaint image attachments stored in GridFS.
+
+Multipart submissions are parsed with a stream factory that writes each
+uploaded file straight into a GridFS upload stream while hashing it, so a
+worker never holds more than one parser chunk of an upload in memory. Blobs
+are content addressed: the ``attachments.files`` collection has a unique
+index on ``sha256``, and an upload whose bytes are already stored is
+discarded in favour of the existing blob.
+
+Complaints keep only attachment metadata (id, filename, type, size, hash);
+the bytes are served by ``download_response`` with Range support and
+long-lived caching, since a blob never changes.
+
+Requests never delete a stored blob: another submission may have matched it
+by hash and not yet inserted its complaint. Blobs no complaint references
+(live or archived) are removed by ``sweep_orphans`` once neither stored nor
+reused for ``ATTACHMENT_ORPHAN_GRACE_SECONDS``.
+
+    python attachments.py --sweep   # delete unreferenced blobs past the grace period
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+from flask import Response, request
+from gridfs import GridFSBucket, NoFile
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import secure_filename
+from conditional import not_modified
+from archive import ARCHIVE_COLLECTION
+
+ATTACHMENT_BUCKET = 'attachments'
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', 5 * 1024 * 1024))
+ATTACHMENT_MAX_FILES = int(os.getenv('ATTACHMENT_MAX_FILES', 3))
+# Bounds text fields and the parser's buffer (which must exceed its 64 KB read size)
+MAX_FORM_FIELD_BYTES = 500 * 1024
+DOWNLOAD_CHUNK_BYTES = 255 * 1024
+CACHE_MAX_AGE_SECONDS = 365 * 24 * 3600
+# Far longer than any request takes to go from storing a blob to inserting its complaint
+ATTACHMENT_ORPHAN_GRACE_SECONDS = int(os.getenv('ATTACHMENT_ORPHAN_GRACE_SECONDS', 3600))
+SWEEP_BATCH_SIZE = 500
+
+# Leading bytes of the image formats the complaint form accepts
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+_SNIFF_BYTES = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+
+def _sniff(head):
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+class BlobUpload:
+    """Write target for one uploaded file: streams into GridFS and hashes as it goes."""
+
+    def __init__(self, db, filename):
+        self.db = db
+        self.bucket = GridFSBucket(db, ATTACHMENT_BUCKET)
+        self.filename = secure_filename(filename or '')[:255] or 'attachment'
+        self.content_type = None
+        self.size = 0
+        self.created = False
+        self.file_id = None
+        self.metadata = None
+        self._head = b''
+        self._hash = hashlib.sha256()
+        self._stream = self.bucket.open_upload_stream(self.filename)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > ATTACHMENT_MAX_BYTES:
+            self.discard()
+            raise RequestEntityTooLarge(f'Attachments may be at most {ATTACHMENT_MAX_BYTES // (1024 * 1024)} MB')
+        if self.content_type is None:
+            self._head += data[:_SNIFF_BYTES]
+            if len(self._head) >= _SNIFF_BYTES:
+                self._check_type()
+        self._hash.update(data)
+        self._stream.write(data)
+
+    def seek(self, *args):
+        # The form parser rewinds each file when it ends; the blob is read back from GridFS
+        return 0
+
+    def _check_type(self):
+        self.content_type = _sniff(self._head)
+        if self.content_type is None:
+            self.discard()
+            raise UnsupportedMediaType('Attachments must be JPG, PNG or GIF images')
+
+    def finish(self):
+        """Store the blob, or reuse an identical one. Returns its metadata, or None if empty."""
+        if not self.size:
+            self._stream.abort()
+            return None
+        if self.content_type is None:
+            self._check_type()
+        digest = self._hash.hexdigest()
+        files = self.db[f'{ATTACHMENT_BUCKET}.files']
+
+        existing = _reuse(files, digest)
+        if existing is None:
+            self._stream.sha256 = digest
+            self._stream.contentType = self.content_type
+            try:
+                self._stream.close()
+                self.file_id, self.created = self._stream._id, True
+            except DuplicateKeyError:
+                # Someone stored the same bytes meanwhile; this copy is ours alone
+                self._delete(self._stream._id)
+                existing = _reuse(files, digest)
+        if existing is not None:
+            self._stream.abort()
+            self.file_id = existing['_id']
+
+        return {
+            'id': self.file_id,
+            'filename': self.filename,
+            'content_type': self.content_type,
+            'size': self.size,
+            'sha256': digest
+        }
+
+    def _delete(self, file_id):
+        try:
+            self.bucket.delete(file_id)
+        except NoFile:
+            pass
+
+    def discard(self):
+        """Abort an unfinished upload; a stored blob is left for ``sweep_orphans``."""
+        if not self._stream.closed:
+            self._stream.abort()
+
+
+def _reuse(files, digest):
+    """Find the blob with ``digest`` and mark it used now, so the sweeper keeps it."""
+    return files.find_one_and_update({'sha256': digest}, {'$set': {'used_at': datetime.utcnow()}},
+                                     projection={'_id': 1})
+
+
+def _stale(cutoff):
+    return {'uploadDate': {'$lt': cutoff},
+            '$or': [{'used_at': {'$exists': False}}, {'used_at': {'$lt': cutoff}}]}
+
+
+def sweep_orphans(db, grace_seconds=ATTACHMENT_ORPHAN_GRACE_SECONDS, batch_size=SWEEP_BATCH_SIZE):
+    """Delete blobs that no complaint references and nobody stored or reused recently.
+
+    Returns how many were deleted.
+    """
+    files = db[f'{ATTACHMENT_BUCKET}.files']
+    chunks = db[f'{ATTACHMENT_BUCKET}.chunks']
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    deleted = 0
+    last_id = None
+    while True:
+        query = _stale(cutoff)
+        if last_id:
+            query['_id'] = {'$gt': last_id}
+        ids = [f['_id'] for f in files.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            return deleted
+        last_id = ids[-1]
+
+        referenced = set()
+        for collection in (db.complaints, db[ARCHIVE_COLLECTION]):
+            for complaint in collection.find({'attachments.id': {'$in': ids}}, {'attachments.id': 1}):
+                referenced.update(a['id'] for a in complaint.get('attachments', []))
+
+        for file_id in ids:
+            if file_id in referenced:
+                continue
+            # Re-check staleness in the delete, so a blob reused since the scan survives
+            if files.delete_one({'_id': file_id, **_stale(cutoff)}).deleted_count:
+                chunks.delete_many({'files_id': file_id})
+                deleted += 1
+
+
+def receive_complaint_form(db, environ):
+    """Parse a multipart complaint, streaming its files into GridFS.
+
+    Returns ``(fields, uploads)``; each upload's ``metadata`` is what the
+    complaint should store, and ``discard_uploads`` removes them again if the
+    complaint is not created.
+    Raises an HTTPException for oversized or non-image files and ValueError
+    for a malformed body.
+    """
+    uploads = []
+
+    def stream_factory(total_content_length, content_type, filename=None, content_length=None):
+        if len(uploads) >= ATTACHMENT_MAX_FILES:
+            raise RequestEntityTooLarge(f'At most {ATTACHMENT_MAX_FILES} attachments are allowed')
+        upload = BlobUpload(db, filename)
+        uploads.append(upload)
+        return upload
+
+    try:
+        _, form, _ = parse_form_data(environ, stream_factory=stream_factory,
+                                     max_form_memory_size=MAX_FORM_FIELD_BYTES, silent=False)
+        for upload in uploads:
+            upload.metadata = upload.finish()
+    except Exception:
+        discard_uploads(uploads)
+        raise
+    return form.to_dict(), [upload for upload in uploads if upload.metadata]
+
+
+def discard_uploads(uploads):
+    for upload in uploads:
+        upload.discard()
+
+
+def download_response(db, attachment):
+    """Serve an attachment's bytes with ETag, caching and single-range support."""
+    etag = f'"{attachment["sha256"]}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': f'private, max-age={CACHE_MAX_AGE_SECONDS}, immutable',
+        'Content-Disposition': f'inline; filename="{attachment["filename"]}"',
+        'X-Content-Type-Options': 'nosniff'
+    }
+    if not_modified(etag):
+        return Response(status=304, headers=headers)
+
+    size = attachment['size']
+    start, stop, status = 0, size, 200
+    # A Range only applies if the client's copy is still this blob
+    if request.range and ('If-Range' not in request.headers
+                          or request.if_range.etag == attachment['sha256']):
+        bounds = request.range.range_for_length(size)
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    stream = GridFSBucket(db, ATTACHMENT_BUCKET).open_download_stream(attachment['id'])
+    stream.seek(start)
+
+    def generate():
+        remaining = stop - start
+        try:
+            while remaining > 0:
+                chunk = stream.read(min(DOWNLOAD_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            stream.close()
+
+    headers['Content-Length'] = str(stop - start)
+    return Response(generate(), status=status, mimetype=attachment['content_type'], headers=headers,
+                    direct_passthrough=True)
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    if '--sweep' not in sys.argv:
+        print('Usage: python attachments.py --sweep')
+        sys.exit(1)
+    print(f'Deleted {sweep_orphans(get_db())} unreferenced attachments')
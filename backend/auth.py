@@ -0,0 +1,133 @@
+"""Bearer-token authentication shared by every protected route.
+
+Each request's token is decoded at most once and its claims are stored on
+``flask.g.user``. Verified tokens are remembered in a bounded LRU keyed by a
+SHA-256 digest of the token, and each entry expires at the token's ``exp``.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+import jwt
+from dotenv import load_dotenv
+from flask import g, request, jsonify
+
+load_dotenv()
+
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+# Upper bound for caching a token that carries no exp claim
+TOKEN_CACHE_MAX_TTL_SECONDS = 300
+
+
+class TokenCache:
+    """Thread-safe LRU of verified token claims."""
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token, claims):
+        expires_at = claims.get('exp', time.time() + TOKEN_CACHE_MAX_TTL_SECONDS)
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+token_cache = TokenCache()
+
+
+def decode_token(token):
+    """Return verified claims for ``token``, using the cache when possible.
+
+    Raises jwt.ExpiredSignatureError or jwt.InvalidTokenError.
+    """
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
+        token_cache.put(token, claims)
+    return claims
+
+
+def authenticate():
+    """Verify the request's bearer token once and store its claims on ``g.user``.
+
+    Returns an error response tuple, or None when the request is authenticated.
+    """
+    if 'user' in g:
+        return None
+
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+    elif request.accept_mimetypes.best == 'text/event-stream' and request.args.get('access_token'):
+        # Browsers' EventSource cannot send headers
+        token = request.args['access_token']
+    else:
+        return jsonify({'error': 'No authorization token provided'}), 401
+
+    try:
+        g.user = decode_token(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({'error': 'Token has expired'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'error': 'Invalid token'}), 401
+    return None
+
+
+def login_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        error = authenticate()
+        if error:
+            return error
+        return f(*args, **kwargs)
+    return decorated
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        error = authenticate()
+        if error:
+            return error
+        if g.user.get('role') != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated
@@ -0,0 +1,176 @@
+"""Boot the API against a local MongoDB (or an in-memory stand-in) and an SMTP sink."""
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+BENCH_PASSWORD = 'benchmark-password'
+# Registration rejects undeliverable domains; the in-process server is told this one is fine
+BENCH_EMAIL_DOMAIN = 'example.com'
+COMPLAINT_TYPES = [
+    'Bus Delays', 'Overcrowding', 'Driver Behavior', 'Route Issues', 'Accessibility Problems',
+    'Bus Cleanliness', 'Lost Items', 'Fare Collection Problems', 'Suggestions for Improvement'
+]
+SEED_BATCH_SIZE = 10000
+# Tracking ids kept in memory for lookup workloads
+SAMPLE_IDS = 10000
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalMongod:
+    """A throwaway mongod on a temporary data directory."""
+
+    def __init__(self, binary='mongod'):
+        self.binary = binary
+        self.dbpath = tempfile.mkdtemp(prefix='bench-mongod-')
+        self.port = _free_port()
+        self.process = None
+
+    @property
+    def uri(self):
+        return f'mongodb://127.0.0.1:{self.port}'
+
+    def start(self, timeout=30):
+        self.process = subprocess.Popen(
+            [self.binary, '--dbpath', self.dbpath, '--port', str(self.port), '--bind_ip', '127.0.0.1', '--quiet'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        client = MongoClient(self.uri, serverSelectionTimeoutMS=500)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                client.admin.command('ping')
+                break
+            except Exception:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError(f'mongod did not start on port {self.port}')
+                time.sleep(0.2)
+        client.close()
+        return self
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+def use_in_memory_mongo():
+    """Route the app's database accessor to mongomock (in-process, no server)."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit('The in-memory backend needs mongomock: pip install mongomock')
+    import database
+    database.MongoClient = mongomock.MongoClient
+
+
+def configure_environment(mongo_uri, smtp_port):
+    """Point the app at the benchmark services before it is imported."""
+    if mongo_uri:
+        os.environ['MONGODB_URI'] = mongo_uri
+    os.environ['SMTP_SERVER'] = '127.0.0.1'
+    os.environ['SMTP_PORT'] = str(smtp_port)
+    os.environ['SMTP_USE_TLS'] = 'false'
+    os.environ['SMTP_PASSWORD'] = ''
+    os.environ.setdefault('SMTP_EMAIL', 'bench@example.com')
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-with-enough-length')
+    # The workloads drive many users from one address; measure the app, not the limiter
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+
+def start_app_server(email_domain=BENCH_EMAIL_DOMAIN):
+    """Serve create_app() on an ephemeral port with a threaded WSGI server.
+
+    ``email_domain`` is pre-seeded as deliverable so registrations reach
+    password hashing instead of failing the DNS check.
+    """
+    from werkzeug.serving import make_server
+    from app import create_app
+    from email_validation import domain_cache
+
+    domain_cache.put(email_domain, (True, None))
+
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def seed(db, complaints, users, progress=None):
+    """Insert ``users`` users and ``complaints`` complaints; return ids for the workloads.
+
+    Counters and rollups are updated per batch the same way the API does.
+    """
+    from complaints import build_complaint
+    from indexes import ensure_indexes
+    from passwords import _hash, PASSWORD_HASH_ROUNDS
+    from stats import record_submissions
+    from analytics import record_rollups
+
+    ensure_indexes(db)
+    rng = random.Random(42)
+
+    password_hash = _hash(BENCH_PASSWORD, PASSWORD_HASH_ROUNDS)
+    emails = [f'bench-user-{i}@example.com' for i in range(users)]
+    for start in range(0, users, SEED_BATCH_SIZE):
+        db.users.insert_many([
+            {'name': f'Bench User {i}', 'email': email, 'password': password_hash, 'role': 'user',
+             'created_at': datetime.utcnow().isoformat()}
+            for i, email in enumerate(emails[start:start + SEED_BATCH_SIZE], start)
+        ], ordered=False)
+    db.users.update_one({'email': emails[0]}, {'$set': {'role': 'admin'}})
+
+    today = datetime.utcnow()
+    sample = []
+    inserted_total = 0
+    for start in range(0, complaints, SEED_BATCH_SIZE):
+        batch = []
+        for _ in range(min(SEED_BATCH_SIZE, complaints - start)):
+            data = {
+                'busNumber': f'KA-{rng.randint(1, 5000):04d}',
+                'routeNumber': str(rng.randint(1, 400)),
+                'complaintType': rng.choice(COMPLAINT_TYPES),
+                'description': 'Seeded complaint ' + ' '.join(rng.choice(['late', 'crowded', 'rude', 'dirty', 'skipped stop']) for _ in range(8)),
+                'location': f'Stop {rng.randint(1, 2000)}',
+                'date': (today - timedelta(days=rng.randint(0, 364))).strftime('%Y-%m-%d')
+            }
+            complaint = build_complaint(data, rng.choice(emails))
+            complaint['status'] = rng.choice(['pending', 'pending', 'in_progress', 'resolved'])
+            batch.append(complaint)
+        try:
+            db.complaints.insert_many(batch, ordered=False)
+            stored = batch
+        except BulkWriteError as e:
+            failed = {error['index'] for error in e.details['writeErrors']}
+            stored = [c for i, c in enumerate(batch) if i not in failed]
+        record_submissions(db, stored)
+        record_rollups(db, stored)
+        inserted_total += len(stored)
+        for complaint in stored:
+            if len(sample) < SAMPLE_IDS:
+                sample.append(str(complaint['_id']))
+            elif rng.random() < SAMPLE_IDS / inserted_total:
+                sample[rng.randrange(SAMPLE_IDS)] = str(complaint['_id'])
+        if progress:
+            progress(inserted_total)
+
+    return {'emails': emails, 'admin_email': emails[0] if emails else None,
+            'tracking_ids': sample, 'complaints': inserted_total}
@@ -0,0 +1,168 @@
+"""Load-test the API and record per-route throughput and latency percentiles.
+
+    cd backend
+    python -m benchmarks.run --mongo memory --complaints 10000
+    python -m benchmarks.run --mongo mongod --complaints 1000000 --concurrency 32
+    python -m benchmarks.run --url http://127.0.0.1:5000 --mongo-uri mongodb://... --no-seed
+
+Results are written to benchmarks/results/<timestamp>-<commit>.json and
+compared with the latest earlier run that used the same settings.
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import harness
+from benchmarks.smtp_sink import SMTPSink
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_WORKLOADS = ['login', 'register_login', 'submit', 'admin_poll', 'track', 'user_list']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for label, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        statuses = recorder.statuses.get(label, {})
+        routes[label] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(label, 0),
+            'non_2xx': len(samples) - statuses.get('2xx', 0),
+            'statuses': statuses,
+            'rps': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+        }
+    return routes
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=harness.BACKEND_DIR, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def previous_result(config):
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), reverse=True):
+        with open(path) as f:
+            result = json.load(f)
+        if result.get('config') == config:
+            return result
+    return None
+
+
+def print_report(results, baseline):
+    print(f"\n{'workload / route':<48}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'non-2xx':>9}{'5xx':>7}")
+    rejected = []
+    for workload, routes in results.items():
+        for label, stats in routes.items():
+            line = (f"{workload + ' ' + label:<48}{stats['rps']:>10.1f}{stats['p50_ms']:>10.1f}"
+                    f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['non_2xx']:>9}{stats['errors']:>7}")
+            if stats['non_2xx']:
+                classes = ', '.join(f'{count} {status_class}' for status_class, count in sorted(stats['statuses'].items()))
+                rejected.append(f'{workload} {label}: {classes}')
+            before = (baseline or {}).get('results', {}).get(workload, {}).get(label)
+            if before and before['p95_ms']:
+                change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+                line += f"   p95 {change:+.0f}% vs {baseline['commit']}"
+            print(line)
+    if rejected:
+        # Rejected requests are usually far cheaper than real ones and skew the numbers
+        print('\nRoutes with non-2xx responses:')
+        for line in rejected:
+            print(f'  {line}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API load test')
+    parser.add_argument('--mongo', choices=['memory', 'mongod', 'uri'], default='memory',
+                        help='in-memory stand-in, a throwaway local mongod, or --mongo-uri')
+    parser.add_argument('--mongod-bin', default='mongod')
+    parser.add_argument('--mongo-uri', default=None)
+    parser.add_argument('--url', default=None, help='benchmark an already running server instead')
+    parser.add_argument('--complaints', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--no-seed', action='store_true', help='use the data already in the database')
+    parser.add_argument('--workloads', nargs='+', default=DEFAULT_WORKLOADS, choices=sorted(DEFAULT_WORKLOADS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per workload')
+    parser.add_argument('--email-domain', default=harness.BENCH_EMAIL_DOMAIN,
+                        help='domain for register_login users; with --url it must pass the DNS check')
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error('--users must be at least 1')
+
+    sink = SMTPSink().start()
+    mongod = None
+    uri = args.mongo_uri
+    if args.mongo == 'mongod':
+        mongod = harness.LocalMongod(args.mongod_bin).start()
+        uri = mongod.uri
+    harness.configure_environment(uri, sink.port)
+    if args.mongo == 'memory':
+        harness.use_in_memory_mongo()
+
+    try:
+        from database import get_db
+        db = get_db()
+        if args.no_seed:
+            admin = db.users.find_one({'role': 'admin', 'email': {'$regex': '^bench-user-'}})
+            seeded = {
+                'emails': [u['email'] for u in db.users.find({'email': {'$regex': '^bench-user-'}}, {'email': 1}).limit(args.users)],
+                'admin_email': admin['email'] if admin else None,
+                'tracking_ids': [str(c['_id']) for c in db.complaints.find({}, {'_id': 1}).limit(harness.SAMPLE_IDS)],
+            }
+        else:
+            started = time.monotonic()
+            seeded = harness.seed(db, args.complaints, args.users,
+                                  progress=lambda n: print(f'\rSeeded {n} complaints', end='', flush=True))
+            print(f'\nSeeding took {time.monotonic() - started:.1f}s')
+
+        base_url = args.url
+        if not base_url:
+            _, base_url = harness.start_app_server(args.email_domain)
+
+        from benchmarks.workloads import Context, run_workload
+        ctx = Context(seeded, args.email_domain)
+        results = {}
+        for name in args.workloads:
+            print(f'Running {name} for {args.duration:.0f}s at concurrency {args.concurrency}...')
+            recorder, elapsed = run_workload(name, base_url, ctx, args.concurrency, args.duration)
+            results[name] = summarize(recorder, elapsed)
+
+        config = {'mongo': args.mongo, 'complaints': args.complaints, 'users': args.users,
+                  'concurrency': args.concurrency, 'duration': args.duration,
+                  'workloads': args.workloads, 'external_server': bool(args.url)}
+        baseline = previous_result(config)
+        print_report(results, baseline)
+
+        commit = git_commit()
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+        with open(path, 'w') as f:
+            json.dump({'commit': commit, 'timestamp': time.time(), 'config': config,
+                       'emails_delivered': sink.messages, 'results': results}, f, indent=2)
+        print(f'\nSaved {path}')
+    finally:
+        sink.shutdown()
+        if mongod:
+            mongod.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
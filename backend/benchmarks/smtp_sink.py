@@ -0,0 +1,58 @@
+"""Minimal SMTP server that accepts and discards every message.
+
+Enough of RFC 5321 for smtplib: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP and
+QUIT. It does not offer STARTTLS or AUTH, so point the app at it with
+SMTP_USE_TLS=false and an empty SMTP_PASSWORD.
+"""
+import socketserver
+import threading
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self._reply('220 smtp-sink ready')
+        in_data = False
+        for raw in self.rfile:
+            line = raw.rstrip(b'\r\n')
+            if in_data:
+                if line == b'.':
+                    in_data = False
+                    self.server.count_message()
+                    self._reply('250 OK: queued')
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self._reply('250 smtp-sink')
+            elif command == b'DATA':
+                in_data = True
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _SinkHandler)
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def count_message(self):
+        with self._lock:
+            self.messages += 1
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True).start()
+        return self
@@ -0,0 +1,158 @@
+"""Scripted request mixes. Each workload performs one operation per call and
+records the latency of every request it makes under a route label."""
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from benchmarks.harness import BENCH_EMAIL_DOMAIN, BENCH_PASSWORD, COMPLAINT_TYPES
+
+
+class HTTPClient:
+    """Keep-alive JSON client; one instance per load-generating thread."""
+
+    def __init__(self, base_url, recorder):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.recorder = recorder
+        self.connection = None
+
+    def request(self, label, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            self.connection = None
+            self.recorder.record(label, time.perf_counter() - started, 599)
+            return 599, None
+        self.recorder.record(label, time.perf_counter() - started, status)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        # label -> {'2xx': n, '4xx': n, ...}; 599 stands for a connection failure
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds, status):
+        with self._lock:
+            self.samples.setdefault(label, []).append(seconds)
+            classes = self.statuses.setdefault(label, {})
+            status_class = f'{status // 100}xx'
+            classes[status_class] = classes.get(status_class, 0) + 1
+            if status >= 500:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+
+class Context:
+    """State shared by the workloads: seeded ids and cached tokens."""
+
+    def __init__(self, seeded, email_domain=BENCH_EMAIL_DOMAIN):
+        self.seeded = seeded
+        self.email_domain = email_domain
+        self.tokens = {}
+        self._lock = threading.Lock()
+
+    def token(self, client, email):
+        with self._lock:
+            token = self.tokens.get(email)
+        if token is None:
+            status, body = client.request('POST /api/auth/login', 'POST', '/api/auth/login',
+                                          {'email': email, 'password': BENCH_PASSWORD})
+            token = body.get('token') if status == 200 and body else None
+            with self._lock:
+                self.tokens[email] = token
+        return token
+
+
+def register_login(client, ctx, rng):
+    email = f'storm-{uuid.uuid4().hex}@{ctx.email_domain}'
+    client.request('POST /api/auth/register', 'POST', '/api/auth/register',
+                   {'name': 'Storm User', 'email': email, 'password': BENCH_PASSWORD})
+    client.request('POST /api/auth/login', 'POST', '/api/auth/login',
+                   {'email': email, 'password': BENCH_PASSWORD})
+
+
+def login(client, ctx, rng):
+    client.request('POST /api/auth/login', 'POST', '/api/auth/login',
+                   {'email': rng.choice(ctx.seeded['emails']), 'password': BENCH_PASSWORD})
+
+
+def submit(client, ctx, rng):
+    token = ctx.token(client, rng.choice(ctx.seeded['emails'][:100]))
+    client.request('POST /api/complaints', 'POST', '/api/complaints', {
+        'busNumber': f'KA-{rng.randint(1, 50000):05d}',
+        'routeNumber': str(rng.randint(1, 400)),
+        'complaintType': rng.choice(COMPLAINT_TYPES),
+        'description': 'Benchmark complaint',
+        'location': f'Stop {rng.randint(1, 2000)}',
+        'date': time.strftime('%Y-%m-%d', time.gmtime())
+    }, token=token)
+
+
+def admin_poll(client, ctx, rng):
+    token = ctx.token(client, ctx.seeded['admin_email'])
+    if rng.random() < 0.5:
+        client.request('GET /api/admin/complaints', 'GET',
+                       '/api/admin/complaints?limit=50&fields=busNumber,routeNumber,complaintType,status',
+                       token=token)
+    else:
+        client.request('GET /api/admin/complaints/stats', 'GET', '/api/admin/complaints/stats', token=token)
+
+
+def track(client, ctx, rng):
+    tracking_id = rng.choice(ctx.seeded['tracking_ids'])
+    client.request('GET /api/complaints/<tracking_id>', 'GET', f'/api/complaints/{tracking_id}')
+
+
+def user_list(client, ctx, rng):
+    token = ctx.token(client, rng.choice(ctx.seeded['emails'][:100]))
+    client.request('GET /api/complaints/user', 'GET', '/api/complaints/user?limit=20', token=token)
+
+
+WORKLOADS = {
+    'register_login': register_login,
+    'login': login,
+    'submit': submit,
+    'admin_poll': admin_poll,
+    'track': track,
+    'user_list': user_list,
+}
+
+
+def run_workload(name, base_url, ctx, concurrency, duration, seed=0):
+    """Drive one workload from ``concurrency`` threads for ``duration`` seconds."""
+    operation = WORKLOADS[name]
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = HTTPClient(base_url, recorder)
+        while time.monotonic() < deadline:
+            operation(client, ctx, rng)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.monotonic() - started
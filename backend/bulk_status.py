@@ -0,0 +1,118 @@
+"""Bulk complaint status changes for the admin API.
+
+Every selected complaint is written by one unordered ``bulk_write`` with one
+``UpdateMany`` per current status. Each update is guarded by that status, so
+a complaint another admin changes in the meantime is reported as a conflict
+and left alone. Counters move with a single ``$inc``, the status history
+gets one ``insert_many``, and users get one email per recipient however
+many of their complaints changed.
+"""
+import os
+from datetime import datetime
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateMany
+from pymongo.errors import DuplicateKeyError
+from archive import ARCHIVE_COLLECTION, OutdatedComplaint, restore
+
+MAX_BULK_STATUS_UPDATE = int(os.getenv('MAX_BULK_STATUS_UPDATE', 5000))
+
+PROJECTION = {'status': 1, 'user_email': 1, 'complaintType': 1, 'routeNumber': 1, 'busNumber': 1, 'created_at': 1}
+
+
+def _now():
+    # BSON datetimes keep milliseconds; truncate so the write can be matched back
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def select_by_ids(db, raw_ids):
+    """Load the complaints named by ``raw_ids``.
+
+    Archived complaints are restored to the live collection first. Returns
+    ``(complaints, results)`` where ``results`` maps each id that cannot be
+    updated to the reason.
+    """
+    results = {}
+    ids = []
+    for raw_id in dict.fromkeys(str(raw_id) for raw_id in raw_ids):
+        try:
+            ids.append(ObjectId(raw_id))
+        except InvalidId:
+            results[raw_id] = 'invalid_id'
+
+    complaints = list(db.complaints.find({'_id': {'$in': ids}}, PROJECTION))
+    found = {complaint['_id'] for complaint in complaints}
+    missing = [complaint_id for complaint_id in ids if complaint_id not in found]
+
+    if missing:
+        archived = [c['_id'] for c in db[ARCHIVE_COLLECTION].find({'_id': {'$in': missing}}, {'_id': 1})]
+        restored = []
+        for complaint_id in archived:
+            try:
+                if restore(db, complaint_id):
+                    restored.append(complaint_id)
+            except DuplicateKeyError:
+                results[str(complaint_id)] = 'reopen_conflict'
+            except OutdatedComplaint:
+                results[str(complaint_id)] = 'needs_migration'
+        if restored:
+            complaints.extend(db.complaints.find({'_id': {'$in': restored}}, PROJECTION))
+        found.update(restored)
+        for complaint_id in missing:
+            results.setdefault(str(complaint_id), 'not_found' if complaint_id not in found else 'conflict')
+
+    return complaints, results
+
+
+def select_by_filter(db, query):
+    """Load the live complaints matching ``query``; ValueError if there are too many."""
+    complaints = list(db.complaints.find(query, PROJECTION).limit(MAX_BULK_STATUS_UPDATE + 1))
+    if len(complaints) > MAX_BULK_STATUS_UPDATE:
+        raise ValueError(f'The filter matches more than {MAX_BULK_STATUS_UPDATE} complaints; narrow it down')
+    return complaints
+
+
+def apply_status(db, complaints, new_status, remarks=''):
+    """Set ``new_status`` on ``complaints`` with one bulk write.
+
+    Returns ``(changes, updated)``: the fields written and the complaints
+    (as loaded, i.e. with their previous status) that the write changed.
+    """
+    if not complaints:
+        return {}, []
+    changes = {'status': new_status, 'remarks': remarks, 'updated_at': _now()}
+
+    by_status = {}
+    for complaint in complaints:
+        by_status.setdefault(complaint.get('status'), []).append(complaint['_id'])
+    result = db.complaints.bulk_write([
+        UpdateMany({'_id': {'$in': ids}, 'status': old_status}, {'$set': changes})
+        for old_status, ids in by_status.items()
+    ], ordered=False)
+
+    if result.matched_count == len(complaints):
+        return changes, complaints
+    # Some changed status under us; keep only the ones this write reached
+    written = {c['_id'] for c in db.complaints.find(
+        {'_id': {'$in': [complaint['_id'] for complaint in complaints]},
+         'status': new_status, 'updated_at': changes['updated_at']}, {'_id': 1})}
+    return changes, [complaint for complaint in complaints if complaint['_id'] in written]
+
+
+def coalesce_notifications(complaints, new_status, remarks=''):
+    """One outbox message per recipient for the updated ``complaints``."""
+    by_recipient = {}
+    for complaint in complaints:
+        by_recipient.setdefault(complaint['user_email'], []).append({
+            'tracking_id': str(complaint['_id']),
+            'new_status': new_status
+        })
+
+    messages = []
+    for recipient, updates in by_recipient.items():
+        if len(updates) == 1:
+            messages.append(('status_update', recipient, {**updates[0], 'remarks': remarks}))
+        else:
+            messages.append(('status_update_digest', recipient, {'updates': updates, 'remarks': remarks}))
+    return messages
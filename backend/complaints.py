@@ -0,0 +1,238 @@
+"""Complaint document construction and duplicate detection.
+
+Every complaint carries a ``dedupe_key`` derived from (bus, route, type,
+service day) and, when the client sends one, an ``idempotency_key``. Both
+are backed by unique indexes, so a submission is a single ``insert_one``
+and a duplicate surfaces as a DuplicateKeyError instead of a racy lookup.
+
+Timestamps are BSON datetimes in UTC. ``date`` keeps the user's incident
+date as ``YYYY-MM-DD`` and ``incident_date`` holds it as a datetime for
+range queries. Optional ``latitude``/``longitude`` become a GeoJSON point in
+``geo``. ``schema_version`` records the layout a document follows;
+``python migrate.py`` brings older documents up to date.
+"""
+import hashlib
+from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError
+from geo import parse_point
+
+DUPLICATE_KEY_ERROR = 11000
+MAX_BATCH_SIZE = 5000
+# Complaints listed in a batch's confirmation email; the response lists them all
+MAX_BATCH_EMAIL_COMPLAINTS = 100
+SCHEMA_VERSION = 2
+
+# Enforced on inserts and on updates to documents that already comply, so
+# complaints written before the migration can still be updated
+COMPLAINT_VALIDATOR = {'$jsonSchema': {
+    'bsonType': 'object',
+    'required': ['date', 'incident_date', 'created_at', 'updated_at', 'schema_version'],
+    'properties': {
+        'date': {'bsonType': 'string', 'pattern': '^[0-9]{4}-[0-9]{2}-[0-9]{2}$'},
+        'incident_date': {'bsonType': 'date'},
+        'created_at': {'bsonType': 'date'},
+        'updated_at': {'bsonType': 'date'},
+        'schema_version': {'bsonType': 'int'},
+        'geo': {
+            'bsonType': 'object',
+            'required': ['type', 'coordinates'],
+            'properties': {
+                'type': {'enum': ['Point']},
+                'coordinates': {'bsonType': 'array', 'minItems': 2, 'maxItems': 2,
+                                'items': {'bsonType': ['double', 'int', 'long']}}
+            }
+        }
+    }
+}}
+
+REQUIRED_FIELDS = ['busNumber', 'routeNumber', 'complaintType', 'description', 'location', 'date']
+# Server-side keys left out of public responses; idempotency_key embeds the submitter's email
+INTERNAL_FIELDS = {'dedupe_key': 0, 'idempotency_key': 0}
+
+
+def _normalize(value):
+    return ' '.join(str(value).split()).casefold()
+
+
+def parse_incident_date(date_string):
+    """Parse the user-supplied incident date (YYYY-MM-DD) to midnight UTC. Raises ValueError."""
+    if not isinstance(date_string, str):
+        raise ValueError('Date must be a string')
+    try:
+        return datetime.strptime(date_string.strip(), '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('Date must be in YYYY-MM-DD format')
+
+
+def service_day(date_string):
+    """Canonical YYYY-MM-DD form of the incident date. Raises ValueError."""
+    return parse_incident_date(date_string).strftime('%Y-%m-%d')
+
+
+def normalize_timestamp(value):
+    """Return a datetime or ISO 8601 string as a naive UTC datetime, or None."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def ensure_schema(db):
+    """Install the validator for the canonical complaint layout."""
+    if 'complaints' in db.list_collection_names():
+        db.command('collMod', 'complaints', validator=COMPLAINT_VALIDATOR, validationLevel='moderate')
+    else:
+        db.create_collection('complaints', validator=COMPLAINT_VALIDATOR, validationLevel='moderate')
+
+
+def dedupe_key(data):
+    """Deterministic key shared by complaints about the same bus, route, type and day."""
+    parts = [
+        _normalize(data['busNumber']),
+        _normalize(data['routeNumber']),
+        _normalize(data['complaintType']),
+        service_day(data['date'])
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+
+def scoped_idempotency_key(user_email, idempotency_key):
+    """Namespace a client idempotency key by user so keys cannot collide across users."""
+    if not idempotency_key:
+        return None
+    return f'{user_email}:{idempotency_key}'
+
+
+def build_complaint(data, user_email, idempotency_key=None):
+    """Build the document for a new complaint. Raises ValueError for a bad date or coordinates.
+
+    Only the complaint form's fields are copied from ``data``; server-owned
+    keys (status, dedupe and idempotency keys, attachments, ``geo``...) are
+    never taken from the client.
+    """
+    now = datetime.utcnow()
+    incident_date = parse_incident_date(data['date'])
+    point = parse_point(data)
+    complaint = {
+        **{field: data[field] for field in REQUIRED_FIELDS},
+        'date': incident_date.strftime('%Y-%m-%d'),
+        'incident_date': incident_date,
+        'user_email': user_email,
+        'status': 'pending',
+        'dedupe_key': dedupe_key(data),
+        'created_at': now,
+        'updated_at': now,
+        'schema_version': SCHEMA_VERSION
+    }
+    if point:
+        complaint['geo'] = point
+    scoped_key = scoped_idempotency_key(user_email, idempotency_key)
+    if scoped_key:
+        complaint['idempotency_key'] = scoped_key
+    return complaint
+
+
+def find_existing(db, complaint):
+    """Return the stored complaint a rejected insert collided with.
+
+    An idempotency key match wins, so a client retry replays the original
+    submission instead of being reported as a duplicate.
+    """
+    if complaint.get('idempotency_key'):
+        existing = db.complaints.find_one({'idempotency_key': complaint['idempotency_key']}, {'_id': 1})
+        if existing:
+            return existing, True
+    existing = db.complaints.find_one({'dedupe_key': complaint['dedupe_key']}, {'_id': 1})
+    return existing, False
+
+
+def _existing_ids(db, field, values):
+    if not values:
+        return {}
+    cursor = db.complaints.find({field: {'$in': list(values)}}, {field: 1})
+    return {document[field]: str(document['_id']) for document in cursor}
+
+
+def ingest_batch(db, items, user_email):
+    """Validate, dedupe and insert a batch of complaints with one unordered insert_many.
+
+    Returns ``(results, inserted)``: one result dict per input item, in
+    order, and the complaint documents that were actually stored.
+    """
+    results = [None] * len(items)
+    pending = []  # (item index, complaint document)
+    seen_dedupe = {}
+    seen_idempotency = {}
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not all(key in item for key in REQUIRED_FIELDS):
+            results[index] = {'index': index, 'status': 'error', 'error': 'Missing required fields'}
+            continue
+        data = dict(item)
+        idempotency_key = data.pop('idempotencyKey', None)
+        try:
+            complaint = build_complaint(data, user_email, idempotency_key)
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+            continue
+
+        # Duplicates within the batch point at the first occurrence
+        first = seen_idempotency.get(complaint.get('idempotency_key'))
+        if first is None:
+            first = seen_dedupe.get(complaint['dedupe_key'])
+        if first is not None:
+            results[index] = {'index': index, 'status': 'duplicate', 'duplicate_of_index': first}
+            continue
+        seen_dedupe[complaint['dedupe_key']] = index
+        if complaint.get('idempotency_key'):
+            seen_idempotency[complaint['idempotency_key']] = index
+        pending.append((index, complaint))
+
+    failed = {}
+    if pending:
+        try:
+            db.complaints.insert_many([complaint for _, complaint in pending], ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index']: error for error in e.details['writeErrors']}
+
+    # Resolve collisions with stored complaints in two lookups
+    collided = [pending[i][1] for i, error in failed.items() if error['code'] == DUPLICATE_KEY_ERROR]
+    by_idempotency = _existing_ids(db, 'idempotency_key',
+                                   {c['idempotency_key'] for c in collided if c.get('idempotency_key')})
+    by_dedupe = _existing_ids(db, 'dedupe_key', {c['dedupe_key'] for c in collided})
+
+    inserted = []
+    for position, (index, complaint) in enumerate(pending):
+        error = failed.get(position)
+        if error is None:
+            inserted.append(complaint)
+            results[index] = {'index': index, 'status': 'created', 'tracking_id': str(complaint['_id'])}
+        elif error['code'] != DUPLICATE_KEY_ERROR:
+            results[index] = {'index': index, 'status': 'error', 'error': error.get('errmsg', 'Write failed')}
+        elif complaint.get('idempotency_key') in by_idempotency:
+            results[index] = {'index': index, 'status': 'created',
+                              'tracking_id': by_idempotency[complaint['idempotency_key']]}
+        else:
+            results[index] = {'index': index, 'status': 'duplicate',
+                              'existing_complaint_id': by_dedupe.get(complaint['dedupe_key'])}
+    return results, inserted
+
+
+def batch_notification(inserted, user_email):
+    """The one outbox message confirming a batch's stored complaints, or None."""
+    if not inserted:
+        return None
+    details = [
+        {'tracking_id': str(complaint['_id']), **{field: complaint[field] for field in REQUIRED_FIELDS}}
+        for complaint in inserted[:MAX_BATCH_EMAIL_COMPLAINTS]
+    ]
+    if len(inserted) == 1:
+        tracking_id = details[0].pop('tracking_id')
+        return 'complaint_confirmation', user_email, {'tracking_id': tracking_id, 'complaint_details': details[0]}
+    return 'batch_confirmation', user_email, {'complaints': details, 'total': len(inserted)}
@@ -0,0 +1,82 @@
+"""ETags, conditional GET and the hot tracking-lookup cache.
+
+ETags are derived from each complaint's id, status and ``updated_at``, so
+they change exactly when a status update does. ``tracking_cache`` keeps the
+serialized body of recently tracked complaints; status updates invalidate
+their entry, and a short TTL bounds staleness for updates made through
+another worker process.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, request
+
+TRACKING_CACHE_SIZE = int(os.getenv('TRACKING_CACHE_SIZE', 10000))
+TRACKING_CACHE_TTL_SECONDS = float(os.getenv('TRACKING_CACHE_TTL_SECONDS', 5))
+
+
+def version_parts(complaint):
+    return (str(complaint['_id']), str(complaint.get('status')), str(complaint.get('updated_at')))
+
+
+def compute_etag(*parts):
+    """Strong ETag over the given values, already quoted for the header."""
+    digest = hashlib.sha1('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def not_modified(etag):
+    """Whether the request's If-None-Match already holds ``etag``."""
+    return request.if_none_match.contains(etag.strip('"'))
+
+
+def conditional_response(etag, body=None):
+    """A 304 when the client's copy is current, otherwise ``body`` as JSON.
+
+    ``body`` may be a callable so the payload is only serialized when needed.
+    """
+    if not_modified(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body() if callable(body) else body, mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+class TrackingCache:
+    """Bounded LRU of ``tracking_id -> (etag, serialized body)`` with a TTL."""
+
+    def __init__(self, max_size=TRACKING_CACHE_SIZE, ttl=TRACKING_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tracking_id):
+        with self._lock:
+            entry = self._entries.get(tracking_id)
+            if entry is None:
+                return None
+            etag, body, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[tracking_id]
+                return None
+            self._entries.move_to_end(tracking_id)
+            return etag, body
+
+    def put(self, tracking_id, etag, body):
+        with self._lock:
+            self._entries[tracking_id] = (etag, body, time.monotonic() + self.ttl)
+            self._entries.move_to_end(tracking_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tracking_id):
+        with self._lock:
+            self._entries.pop(str(tracking_id), None)
+
+
+tracking_cache = TrackingCache()
@@ -0,0 +1,62 @@
+"""Shared MongoDB access.
+
+The client is created lazily on first use in each process, so importing the
+app does no network work and a pre-fork server never hands a client created
+in the master to its workers. Every module uses the ``db`` proxy (or
+``get_db()``) instead of holding its own client.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from werkzeug.local import LocalProxy
+
+load_dotenv()
+
+DATABASE_NAME = 'complaint_system'
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def client_options():
+    """Connection pool settings, overridable through the environment."""
+    return {
+        'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+        'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000)),
+        'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+        'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    }
+
+
+def get_client():
+    """Return this process's MongoClient, creating it on first use or after a fork."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(os.getenv('MONGODB_URI'), connect=False, **client_options())
+                _client_pid = pid
+    return _client
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+def close_client():
+    """Close this process's client, e.g. in a pre-fork master before forking."""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+db = LocalProxy(get_db)
@@ -2,9 +2,11 @@ import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import smtplib
+import threading
+from collections import deque
 from dotenv import load_dotenv
 import logging
-from email_templates.password_reset import send_password_reset_email
+from metrics import smtp_phase
 
 load_dotenv()
 
@@ -12,14 +14,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def send_complaint_confirmation(recipient_email, tracking_id, complaint_details):
-    # Email configuration
-    sender_email = os.getenv('SMTP_EMAIL')
-    sender_password = os.getenv('SMTP_PASSWORD')
-    smtp_server = 'smtp.gmail.com'
-    smtp_port = 587
 
-    # Create message
+def build_complaint_confirmation(sender_email, recipient_email, tracking_id, complaint_details):
+    """Build the confirmation message sent after a complaint is submitted."""
     message = MIMEMultipart()
     message['From'] = sender_email
     message['To'] = recipient_email
@@ -45,42 +42,11 @@ Best regards,
 Bus Complaint Management System"""
 
     message.attach(MIMEText(body, 'plain'))
+    return message
 
-    # Create SMTP session
-    try:
-        logger.info(f"Attempting to connect to SMTP server {smtp_server}:{smtp_port}")
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        
-        # Login to the server
-        logger.info(f"Attempting to login with email {sender_email}")
-        server.login(sender_email, sender_password)
-
-        # Send email
-        text = message.as_string()
-        server.sendmail(sender_email, recipient_email, text)
-        server.quit()
-        logger.info(f"Email sent successfully to {recipient_email}")
-        return True
-    except smtplib.SMTPAuthenticationError:
-        logger.error("SMTP Authentication failed. Please check your email and app password.")
-        logger.error("Please make sure you have:\n1. Enabled 2-Step Verification in your Google Account\n2. Generated an App Password for this application\n3. Used the App Password in the .env file")
-        return False
-    except smtplib.SMTPException as e:
-        logger.error(f"SMTP error occurred: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(f"Unexpected error occurred while sending email: {str(e)}")
-        return False
 
-def send_status_update_notification(recipient_email, tracking_id, new_status, remarks=''):
-    # Email configuration
-    sender_email = os.getenv('SMTP_EMAIL')
-    sender_password = os.getenv('SMTP_PASSWORD')
-    smtp_server = 'smtp.gmail.com'
-    smtp_port = 587
-
-    # Create message
+def build_status_update_notification(sender_email, recipient_email, tracking_id, new_status, remarks=''):
+    """Build the notification sent when an admin changes a complaint's status."""
     message = MIMEMultipart()
     message['From'] = sender_email
     message['To'] = recipient_email
@@ -102,29 +68,256 @@ Best regards,
 Bus Complaint Management System"""
 
     message.attach(MIMEText(body, 'plain'))
+    return message
+
+
+def build_status_digest_notification(sender_email, recipient_email, updates, remarks=''):
+    """Build one notification covering several complaints updated together."""
+    message = MIMEMultipart()
+    message['From'] = sender_email
+    message['To'] = recipient_email
+    message['Subject'] = f'Status Update for {len(updates)} Complaints'
+
+    lines = '\n'.join(f"- {update['tracking_id']}: {update['new_status']}" for update in updates)
+
+    # Email body
+    body = f"""Dear User,
+
+This is to inform you that the status of the following complaints has been updated.
+
+{lines}
+
+Remarks: {remarks if remarks else 'No additional remarks'}
+
+You can track your complaints using the tracking IDs on our website.
+
+Best regards,
+Bus Complaint Management System"""
+
+    message.attach(MIMEText(body, 'plain'))
+    return message
+
 
-    # Create SMTP session
+def build_batch_confirmation(sender_email, recipient_email, complaints, total):
+    """Build one confirmation for a batch submission; ``complaints`` may list only the first few."""
+    message = MIMEMultipart()
+    message['From'] = sender_email
+    message['To'] = recipient_email
+    message['Subject'] = f'Confirmation for {total} Submitted Complaints'
+
+    lines = '\n'.join(
+        f"- {complaint['tracking_id']}: bus {complaint['busNumber']}, route {complaint['routeNumber']}, "
+        f"{complaint['complaintType']}, {complaint['date']}"
+        for complaint in complaints
+    )
+    if total > len(complaints):
+        lines += f'\n- ... and {total - len(complaints)} more'
+
+    # Email body
+    body = f"""Dear User,
+
+Thank you for submitting your complaints. {total} complaints have been successfully registered in our system.
+
+{lines}
+
+You can track the status of each complaint using its tracking ID on our website.
+
+Best regards,
+Bus Complaint Management System"""
+
+    message.attach(MIMEText(body, 'plain'))
+    return message
+
+
+def build_password_reset_email(sender_email, recipient_email, reset_token):
+    """Build the password reset message carrying a one-hour reset link."""
+    reset_url = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/reset-password?token={reset_token}"
+
+    message = MIMEMultipart()
+    message['From'] = sender_email
+    message['To'] = recipient_email
+    message['Subject'] = 'Password Reset Request'
+
+    # Email body
+    body = f"""Dear User,
+
+We received a request to reset the password for your account.
+
+Use the link below to choose a new password. The link expires in one hour.
+
+{reset_url}
+
+If you did not request a password reset, you can ignore this email.
+
+Best regards,
+Bus Complaint Management System"""
+
+    message.attach(MIMEText(body, 'plain'))
+    return message
+
+
+# Message builders by outbox kind; payload keys map onto builder arguments
+MESSAGE_BUILDERS = {
+    'complaint_confirmation': lambda sender, to, p: build_complaint_confirmation(
+        sender, to, p['tracking_id'], p['complaint_details']),
+    'status_update': lambda sender, to, p: build_status_update_notification(
+        sender, to, p['tracking_id'], p['new_status'], p.get('remarks', '')),
+    'status_update_digest': lambda sender, to, p: build_status_digest_notification(
+        sender, to, p['updates'], p.get('remarks', '')),
+    'batch_confirmation': lambda sender, to, p: build_batch_confirmation(
+        sender, to, p['complaints'], p['total']),
+    'password_reset': lambda sender, to, p: build_password_reset_email(
+        sender, to, p['reset_token']),
+}
+
+
+class SMTPConnectionPool:
+    """A small pool of authenticated SMTP sessions that are reused across sends.
+
+    Opening a session costs a TCP connect, STARTTLS and LOGIN, so idle
+    sessions are kept and handed back out. A session that the server has
+    dropped is discarded and replaced on the next checkout.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 use_tls=None, max_size=None, timeout=30):
+        self.host = host or os.getenv('SMTP_SERVER', 'smtp.gmail.com')
+        self.port = int(port or os.getenv('SMTP_PORT', 587))
+        self.username = username if username is not None else os.getenv('SMTP_EMAIL')
+        self.password = password if password is not None else os.getenv('SMTP_PASSWORD')
+        if use_tls is None:
+            use_tls = os.getenv('SMTP_USE_TLS', 'true').lower() != 'false'
+        self.use_tls = use_tls
+        self.max_size = int(max_size or os.getenv('SMTP_POOL_SIZE', 2))
+        self.timeout = timeout
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        logger.info(f"Attempting to connect to SMTP server {self.host}:{self.port}")
+        with smtp_phase('connect'):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                with smtp_phase('starttls'):
+                    server.starttls()
+            if self.username and self.password:
+                logger.info(f"Attempting to login with email {self.username}")
+                with smtp_phase('login'):
+                    server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _checkout(self):
+        self._slots.acquire()
+        with self._lock:
+            server = self._idle.popleft() if self._idle else None
+        try:
+            return server or self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, server):
+        with self._lock:
+            self._idle.append(server)
+        self._slots.release()
+
+    def _discard(self, server):
+        try:
+            server.close()
+        except Exception:
+            pass
+        self._slots.release()
+
+    def send(self, message):
+        """Send a MIME message, reconnecting once if a pooled session went stale."""
+        for attempt in range(2):
+            server = self._checkout()
+            try:
+                with smtp_phase('send'):
+                    server.sendmail(message['From'], message['To'], message.as_string())
+            except smtplib.SMTPServerDisconnected:
+                self._discard(server)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                self._discard(server)
+                raise
+            self._checkin(server)
+            return
+
+    def close(self):
+        """Quit every idle session."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for server in idle:
+            try:
+                with smtp_phase('quit'):
+                    server.quit()
+            except Exception:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool():
+    """Return the process-wide SMTP connection pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPConnectionPool()
+        return _pool
+
+
+def send_email(kind, recipient_email, payload, pool=None):
+    """Render an outbox message of the given kind and send it through the pool.
+
+    Errors are raised so the caller (normally the outbox worker) can decide
+    whether to retry.
+    """
+    pool = pool or get_smtp_pool()
+    message = MESSAGE_BUILDERS[kind](pool.username, recipient_email, payload)
+    pool.send(message)
+    logger.info(f"{kind} email sent successfully to {recipient_email}")
+
+
+def _send_logged(kind, recipient_email, payload):
     try:
-        logger.info(f"Attempting to connect to SMTP server {smtp_server}:{smtp_port}")
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        
-        # Login to the server
-        logger.info(f"Attempting to login with email {sender_email}")
-        server.login(sender_email, sender_password)
-
-        # Send email
-        text = message.as_string()
-        server.sendmail(sender_email, recipient_email, text)
-        server.quit()
-        logger.info(f"Status update email sent successfully to {recipient_email}")
+        send_email(kind, recipient_email, payload)
         return True
     except smtplib.SMTPAuthenticationError:
         logger.error("SMTP Authentication failed. Please check your email and app password.")
+        logger.error("Please make sure you have:\n1. Enabled 2-Step Verification in your Google Account\n2. Generated an App Password for this application\n3. Used the App Password in the .env file")
         return False
     except smtplib.SMTPException as e:
         logger.error(f"SMTP error occurred: {str(e)}")
         return False
     except Exception as e:
         logger.error(f"Unexpected error occurred while sending email: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+def send_complaint_confirmation(recipient_email, tracking_id, complaint_details):
+    return _send_logged('complaint_confirmation', recipient_email, {
+        'tracking_id': tracking_id,
+        'complaint_details': complaint_details
+    })
+
+
+def send_status_update_notification(recipient_email, tracking_id, new_status, remarks=''):
+    return _send_logged('status_update', recipient_email, {
+        'tracking_id': tracking_id,
+        'new_status': new_status,
+        'remarks': remarks
+    })
+
+
+def send_password_reset_email(recipient_email, reset_token):
+    return _send_logged('password_reset', recipient_email, {'reset_token': reset_token})
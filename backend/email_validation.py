@@ -0,0 +1,144 @@
+"""Registration email checks that keep DNS off the request path.
+
+Syntax is validated inline. Whether a domain accepts mail is answered from a
+TTL cache (failures are cached too, for a shorter time); on a miss the DNS
+lookup runs on a small thread pool and registration waits at most
+``EMAIL_DNS_WAIT_MS`` for it. If the answer arrives later it is cached for
+the next registration, and ``flag_if_undeliverable`` marks the new account.
+"""
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from email_validator import validate_email, EmailNotValidError, EmailUndeliverableError
+
+logger = logging.getLogger(__name__)
+
+# 0 never waits: every uncached domain is checked in the background
+EMAIL_DNS_WAIT_SECONDS = float(os.getenv('EMAIL_DNS_WAIT_MS', 100)) / 1000
+EMAIL_DNS_TIMEOUT_SECONDS = int(os.getenv('EMAIL_DNS_TIMEOUT_SECONDS', 5))
+EMAIL_DOMAIN_CACHE_TTL_SECONDS = float(os.getenv('EMAIL_DOMAIN_CACHE_TTL_SECONDS', 24 * 3600))
+EMAIL_DOMAIN_NEGATIVE_TTL_SECONDS = float(os.getenv('EMAIL_DOMAIN_NEGATIVE_TTL_SECONDS', 600))
+EMAIL_DOMAIN_CACHE_SIZE = 10000
+EMAIL_DNS_WORKERS = 4
+
+
+def validate_syntax(email):
+    """Return the validated address without any DNS lookup. Raises EmailNotValidError."""
+    return validate_email(email, check_deliverability=False)
+
+
+class DomainCache:
+    """Bounded LRU of ``domain -> (deliverable, reason)`` with separate TTLs per outcome."""
+
+    def __init__(self, max_size=EMAIL_DOMAIN_CACHE_SIZE, ttl=EMAIL_DOMAIN_CACHE_TTL_SECONDS,
+                 negative_ttl=EMAIL_DOMAIN_NEGATIVE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain):
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is None:
+                return None
+            result, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[domain]
+                return None
+            self._entries.move_to_end(domain)
+            return result
+
+    def put(self, domain, result):
+        ttl = self.ttl if result[0] else self.negative_ttl
+        with self._lock:
+            self._entries[domain] = (result, time.monotonic() + ttl)
+            self._entries.move_to_end(domain)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+domain_cache = DomainCache()
+
+_executor = None
+_executor_pid = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def _resolve(domain):
+    try:
+        validate_email(f'postmaster@{domain}', check_deliverability=True,
+                       timeout=EMAIL_DNS_TIMEOUT_SECONDS)
+        result = (True, None)
+    except EmailUndeliverableError as e:
+        result = (False, str(e))
+    except EmailNotValidError as e:
+        result = (False, str(e))
+    domain_cache.put(domain, result)
+    return result
+
+
+def _lookup(domain):
+    """Return the future resolving ``domain``, sharing one per domain in flight."""
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # Threads do not survive fork(), so each worker gets its own pool
+            _executor = ThreadPoolExecutor(max_workers=EMAIL_DNS_WORKERS, thread_name_prefix='email-dns')
+            _executor_pid = os.getpid()
+            _pending.clear()
+        future = _pending.get(domain)
+        if future is not None:
+            return future
+        future = _executor.submit(_resolve, domain)
+        _pending[domain] = future
+    # Outside the lock: the callback runs inline if the lookup already finished
+    future.add_done_callback(lambda f: _forget(domain, f))
+    return future
+
+
+def _forget(domain, future):
+    with _lock:
+        if _pending.get(domain) is future:
+            del _pending[domain]
+
+
+def check_domain(domain, wait=EMAIL_DNS_WAIT_SECONDS):
+    """Return ``(deliverable, reason)``; ``deliverable`` is None when not known yet."""
+    cached = domain_cache.get(domain)
+    if cached is not None:
+        return cached
+    future = _lookup(domain)
+    try:
+        return future.result(timeout=wait)
+    except TimeoutError:
+        return None, None
+    except Exception as e:
+        logger.warning(f'Email domain lookup for {domain} failed: {str(e)}')
+        return None, None
+
+
+def flag_if_undeliverable(db, email, domain):
+    """Once the lookup for ``domain`` finishes, mark the account if mail cannot reach it."""
+    def flag(result):
+        deliverable, reason = result
+        if not deliverable:
+            db.users.update_one({'email': email}, {'$set': {'email_undeliverable': True}})
+            logger.info(f'Registered email {email} is undeliverable: {reason}')
+
+    def done(future):
+        try:
+            flag(future.result())
+        except Exception as e:
+            logger.warning(f'Email domain lookup for {domain} failed: {str(e)}')
+
+    cached = domain_cache.get(domain)
+    if cached is not None:
+        flag(cached)
+    else:
+        _lookup(domain).add_done_callback(done)
@@ -0,0 +1,245 @@
+"""Complaint status changes pushed to clients as Server-Sent Events.
+
+Status changes are published to an in-process broker. Events are kept in a
+bounded ring buffer and serialized once; a subscriber is only a topic, a
+filter and the id of the last event it has seen, and it sleeps on a
+condition shared by everyone subscribed to the same topic (``user:<email>``
+or ``admin``). Clients that fall further behind than the buffer receive a
+``reset`` event and should refetch.
+
+With ``EVENTS_BACKEND=local`` (the default) the request that changes a
+status publishes directly, so only subscribers on the same worker process
+see it. ``EVENTS_BACKEND=changestream`` instead has every worker follow a
+MongoDB change stream on ``complaints`` (this needs a replica set), so all
+workers see every change.
+
+Each open stream occupies a server thread (or a greenlet under gevent) for
+as long as the client stays connected, so a worker accepts at most
+``EVENTS_MAX_STREAMS`` streams and answers 503 beyond that instead of
+starving every other endpoint. ``serve.py`` derives the default from the
+worker class; run gevent workers to hold thousands of streams.
+"""
+import json
+import os
+import threading
+import time
+import logging
+from collections import deque
+from flask import jsonify
+from pymongo.errors import OperationFailure, PyMongoError
+from json_provider import encode_default
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BACKEND = os.getenv('EVENTS_BACKEND', 'local')
+EVENTS_BUFFER_SIZE = int(os.getenv('EVENTS_BUFFER_SIZE', 1024))
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv('EVENTS_KEEPALIVE_SECONDS', 15))
+# Open streams per worker process; keep it below the worker's threads or connections
+EVENTS_MAX_STREAMS = int(os.getenv('EVENTS_MAX_STREAMS', 1000))
+# Browsers reconnect after this long when a stream drops
+EVENTS_RETRY_MS = 5000
+
+EVENT_FIELDS = ('status', 'remarks', 'updated_at', 'complaintType', 'routeNumber', 'busNumber')
+
+# ChangeStreamFatalError, ChangeStreamHistoryLost: the resume token is no longer usable
+CHANGE_STREAM_LOST_CODES = (280, 286)
+
+# Admin stream query parameters and the event fields they filter on
+ADMIN_FILTERS = {'status': 'status', 'type': 'complaintType', 'route': 'routeNumber'}
+
+
+class StreamsBusy(Exception):
+    """Raised when this worker already serves ``EVENTS_MAX_STREAMS`` streams."""
+
+
+class _Stream:
+    """Response iterable that gives its stream slot back when the server closes it."""
+
+    def __init__(self, frames, release):
+        self._frames = frames
+        self._release = release
+
+    def __iter__(self):
+        return self._frames
+
+    def close(self):
+        self._frames.close()
+        if self._release:
+            self._release, release = None, self._release
+            release()
+
+
+class Broker:
+    def __init__(self, size=EVENTS_BUFFER_SIZE, max_streams=EVENTS_MAX_STREAMS):
+        # Prefixes event ids so a Last-Event-ID from another process is not misread
+        self.id = os.urandom(4).hex()
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._stream_slots = threading.BoundedSemaphore(max_streams)
+
+    def publish(self, topics, data):
+        body = json.dumps(data, default=encode_default, separators=(',', ':'))
+        with self._lock:
+            self._seq += 1
+            self._events.append((self._seq, topics, data, body))
+            waiting = [self._topics[topic][0] for topic in topics if topic in self._topics]
+        for condition in waiting:
+            with condition:
+                condition.notify_all()
+
+    def mark_gap(self):
+        """Send every stream a ``reset``: events may have been missed since its last one."""
+        with self._lock:
+            self._events.clear()
+            self._seq += 1
+            waiting = [entry[0] for entry in self._topics.values()]
+        for condition in waiting:
+            with condition:
+                condition.notify_all()
+
+    def _subscribe(self, topic):
+        with self._lock:
+            entry = self._topics.setdefault(topic, [threading.Condition(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _unsubscribe(self, topic):
+        with self._lock:
+            entry = self._topics[topic]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._topics[topic]
+
+    def _since(self, topic, last_seq):
+        """Events for ``topic`` after ``last_seq``, the newest seq and whether any were lost."""
+        with self._lock:
+            events = []
+            for seq, topics, data, body in reversed(self._events):
+                if seq <= last_seq:
+                    break
+                if topic in topics:
+                    events.append((seq, data, body))
+            oldest = self._events[0][0] if self._events else self._seq + 1
+            return events[::-1], self._seq, oldest > last_seq + 1
+
+    def parse_event_id(self, event_id):
+        """The sequence number in a Last-Event-ID from this broker, else None."""
+        broker_id, _, seq = (event_id or '').partition('.')
+        if broker_id != self.id or not seq.isdigit():
+            return None
+        return min(int(seq), self._seq)
+
+    def stream(self, topic, matches=None, last_event_id=None):
+        """SSE frames for ``topic`` until the client disconnects. Raises StreamsBusy."""
+        if not self._stream_slots.acquire(blocking=False):
+            raise StreamsBusy()
+        return _Stream(self._frames(topic, matches, last_event_id), self._stream_slots.release)
+
+    def _frames(self, topic, matches, last_event_id):
+        condition = self._subscribe(topic)
+        metrics.EVENT_STREAMS.labels(topic.partition(':')[0]).inc()
+        try:
+            last_seq = self.parse_event_id(last_event_id)
+            if last_seq is None:
+                last_seq = self._seq
+            yield f'retry: {EVENTS_RETRY_MS}\n\n'
+            while True:
+                events, newest, missed = self._since(topic, last_seq)
+                if missed:
+                    yield 'event: reset\ndata: {}\n\n'
+                for seq, data, body in events:
+                    if matches is None or matches(data):
+                        yield f'id: {self.id}.{seq}\nevent: status\ndata: {body}\n\n'
+                last_seq = newest
+                with condition:
+                    if self._seq == last_seq:
+                        condition.wait(EVENTS_KEEPALIVE_SECONDS)
+                if self._seq == last_seq:
+                    # Keeps proxies from timing out the connection and detects dead clients
+                    yield ': keepalive\n\n'
+        finally:
+            metrics.EVENT_STREAMS.labels(topic.partition(':')[0]).dec()
+            self._unsubscribe(topic)
+
+
+broker = Broker()
+
+
+def busy_response():
+    response = jsonify({
+        'error': 'Server busy',
+        'details': 'Too many event streams are open. Please reconnect shortly.'
+    })
+    response.headers['Retry-After'] = str(EVENTS_RETRY_MS // 1000)
+    return response, 503
+
+
+def publish_complaint(complaint):
+    """Fan a complaint's current status out to its owner and the admin firehose."""
+    data = {'tracking_id': str(complaint['_id'])}
+    data.update({field: complaint.get(field) for field in EVENT_FIELDS})
+    broker.publish((f"user:{complaint['user_email']}", 'admin'), data)
+
+
+def complaint_changed(complaint):
+    """Called by request handlers after a status change is written."""
+    if EVENTS_BACKEND == 'local':
+        publish_complaint(complaint)
+
+
+def admin_filter(args):
+    """Build the event predicate for the admin stream's query parameters, or None."""
+    wanted = {field: args[param] for param, field in ADMIN_FILTERS.items() if args.get(param)}
+    if not wanted:
+        return None
+    return lambda data: all(data.get(field) == value for field, value in wanted.items())
+
+
+class ChangeStreamRelay(threading.Thread):
+    """Publishes status updates seen on the complaints change stream."""
+
+    PIPELINE = [{'$match': {
+        'operationType': 'update',
+        'updateDescription.updatedFields.status': {'$exists': True}
+    }}]
+
+    def __init__(self, db):
+        super().__init__(name='complaint-change-stream', daemon=True)
+        self.db = db
+
+    def run(self):
+        resume_token = None
+        while True:
+            try:
+                with self.db.complaints.watch(self.PIPELINE, full_document='updateLookup',
+                                              resume_after=resume_token) as changes:
+                    for change in changes:
+                        resume_token = changes.resume_token
+                        if change.get('fullDocument'):
+                            publish_complaint(change['fullDocument'])
+            except OperationFailure as e:
+                if resume_token is not None and (e.code in CHANGE_STREAM_LOST_CODES or
+                                                 e.has_error_label('NonResumableChangeStreamError')):
+                    # The token has left the oplog; retrying with it would fail forever
+                    logger.error(f'Complaint change stream cannot resume, restarting from now; '
+                                 f'changes made meanwhile were not published: {str(e)}')
+                    resume_token = None
+                    broker.mark_gap()
+                    continue
+                logger.warning(f'Complaint change stream interrupted, retrying: {str(e)}')
+                time.sleep(5)
+            except PyMongoError as e:
+                logger.warning(f'Complaint change stream interrupted, retrying: {str(e)}')
+                time.sleep(5)
+
+
+def start(db):
+    """Per-process startup: follow the change stream when that backend is selected."""
+    if EVENTS_BACKEND == 'changestream':
+        relay = ChangeStreamRelay(db)
+        relay.start()
+        return relay
+    return None
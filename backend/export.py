@@ -0,0 +1,70 @@
+"""Streaming NDJSON and CSV encoders for complaint exports.
+
+Each encoder consumes a Mongo cursor lazily and yields one chunk per
+``EXPORT_BATCH_SIZE`` documents, so memory use does not grow with the size
+of the export.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from bson.objectid import ObjectId
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+CSV_COLUMNS = [
+    '_id', 'busNumber', 'routeNumber', 'complaintType', 'description', 'location',
+    'date', 'status', 'remarks', 'user_email', 'created_at', 'updated_at'
+]
+
+
+def _encode_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _batches(cursor, size=EXPORT_BATCH_SIZE):
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_ndjson(cursor):
+    """Yield complaints as newline-delimited JSON."""
+    for batch in _batches(cursor):
+        yield ''.join(json.dumps(document, default=_encode_value) + '\n' for document in batch)
+
+
+def generate_csv(cursor):
+    """Yield complaints as CSV with a header row and a fixed column set."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for batch in _batches(cursor):
+        for document in batch:
+            writer.writerow([
+                '' if document.get(column) is None else _encode_value(document[column])
+                for column in CSV_COLUMNS
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# format name -> (generator, mimetype)
+EXPORT_FORMATS = {
+    'ndjson': (generate_ndjson, 'application/x-ndjson'),
+    'csv': (generate_csv, 'text/csv'),
+}
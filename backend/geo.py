@@ -0,0 +1,275 @@
+"""Complaint coordinates, area queries and heatmap tiles.
+
+A complaint may carry ``latitude``/``longitude``; it is stored as a GeoJSON
+point in ``geo`` behind a 2dsphere index, next to the free-text
+``location``. Admins can list complaints within a radius of a point or
+inside a map viewport.
+
+Heatmap tiles follow the web map XYZ scheme. ``complaint_heatmap`` holds a
+pyramid of pre-aggregated counts: one document per occupied cell at every
+level from 0 to ``HEATMAP_MAX_ZOOM + GRID_BITS``, where a cell at level
+``z + GRID_BITS`` is one bin of a tile at zoom ``z``. A submission ``$inc``s
+one cell per level, and a tile reads at most ``GRID_SIZE ** 2`` cells
+through the ``level_x_y`` index. Serialized tiles are cached per process;
+a submission drops the tiles that contain it, and a short TTL bounds
+staleness for submissions made through another worker.
+
+    python geo.py --rebuild   # recompute the heatmap pyramid in batches
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from pymongo import UpdateOne
+from archive import ARCHIVE_COLLECTION
+from indexes import INDEXES
+
+HEATMAP_COLLECTION = 'complaint_heatmap'
+HEATMAP_MAX_ZOOM = int(os.getenv('HEATMAP_MAX_ZOOM', 18))
+HEATMAP_CACHE_SIZE = int(os.getenv('HEATMAP_CACHE_SIZE', 5000))
+HEATMAP_CACHE_TTL_SECONDS = float(os.getenv('HEATMAP_CACHE_TTL_SECONDS', 30))
+MAX_RADIUS_METERS = 50000
+REBUILD_BATCH_SIZE = 10000
+
+# Each tile is split into GRID_SIZE x GRID_SIZE bins
+GRID_BITS = 4
+GRID_SIZE = 1 << GRID_BITS
+_DEEPEST_LEVEL = HEATMAP_MAX_ZOOM + GRID_BITS
+
+EARTH_RADIUS_METERS = 6378100
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+
+
+def _number(value, name, low, high):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if not low <= number <= high:
+        raise ValueError(f'{name} must be between {low} and {high}')
+    return number
+
+
+def parse_point(data):
+    """GeoJSON point for a complaint's ``latitude``/``longitude``, or None. Raises ValueError."""
+    latitude, longitude = data.get('latitude'), data.get('longitude')
+    if latitude in (None, '') and longitude in (None, ''):
+        return None
+    if latitude in (None, '') or longitude in (None, ''):
+        raise ValueError('Provide both latitude and longitude')
+    return {'type': 'Point', 'coordinates': [_number(longitude, 'longitude', -180, 180),
+                                             _number(latitude, 'latitude', -90, 90)]}
+
+
+def area_query(args):
+    """``geo`` filter for ``lat``/``lng``/``radius`` (meters) or ``bbox`` (west,south,east,north).
+
+    Raises ValueError for missing or malformed parameters.
+    """
+    if args.get('bbox'):
+        parts = args['bbox'].split(',')
+        if len(parts) != 4:
+            raise ValueError('bbox must be west,south,east,north')
+        west, east = (_number(parts[i], 'bbox longitude', -180, 180) for i in (0, 2))
+        south, north = (_number(parts[i], 'bbox latitude', -90, 90) for i in (1, 3))
+        if west >= east or south >= north or east - west >= 180:
+            raise ValueError('bbox must be west,south,east,north and under 180 degrees wide')
+        ring = [[west, south], [east, south], [east, north], [west, north], [west, south]]
+        return {'geo': {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [ring]}}}}
+
+    if not args.get('lat') or not args.get('lng'):
+        raise ValueError('Pass lat, lng and radius, or bbox')
+    center = [_number(args['lng'], 'lng', -180, 180), _number(args['lat'], 'lat', -90, 90)]
+    radius = _number(args.get('radius', 500), 'radius', 1, MAX_RADIUS_METERS)
+    return {'geo': {'$geoWithin': {'$centerSphere': [center, radius / EARTH_RADIUS_METERS]}}}
+
+
+def tile_of(longitude, latitude, zoom):
+    """XYZ tile containing a point at ``zoom``."""
+    n = 1 << zoom
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom, x, y):
+    """``[west, south, east, north]`` of an XYZ tile."""
+    n = 1 << zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return [x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)]
+
+
+def _type_key(value):
+    return str(value).replace('.', '_').lstrip('$') or '_'
+
+
+def _coordinates(complaint):
+    """``(longitude, latitude)`` of a stored complaint, or None if ``geo`` is not a valid point."""
+    point = complaint.get('geo')
+    try:
+        longitude, latitude = point['coordinates']
+        if point['type'] == 'Point' and -180 <= longitude <= 180 and -90 <= latitude <= 90:
+            return longitude, latitude
+    except (TypeError, KeyError, ValueError):
+        pass
+    return None
+
+
+def _cell_counts(complaints):
+    counts = {}
+    for complaint in complaints:
+        coordinates = _coordinates(complaint)
+        if coordinates is None:
+            continue
+        longitude, latitude = coordinates
+        deepest = tile_of(longitude, latitude, _DEEPEST_LEVEL)
+        type_key = _type_key(complaint.get('complaintType'))
+        for level in range(_DEEPEST_LEVEL + 1):
+            shift = _DEEPEST_LEVEL - level
+            key = (level, deepest[0] >> shift, deepest[1] >> shift, type_key)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def _apply_counts(collection, counts):
+    if not counts:
+        return
+    cells = {}
+    for (level, x, y, type_key), count in counts.items():
+        increments = cells.setdefault((level, x, y), {'count': 0})
+        increments['count'] += count
+        increments[f'by_type.{type_key}'] = count
+    collection.bulk_write([
+        UpdateOne({'_id': f'{level}/{x}/{y}'},
+                  {'$inc': increments, '$setOnInsert': {'level': level, 'x': x, 'y': y}},
+                  upsert=True)
+        for (level, x, y), increments in cells.items()
+    ], ordered=False)
+
+
+class TileCache:
+    """Bounded LRU of ``(z, x, y) -> {type: (etag, serialized body, expires_at)}``."""
+
+    def __init__(self, max_size=HEATMAP_CACHE_SIZE, ttl=HEATMAP_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tile, complaint_type):
+        with self._lock:
+            entry = self._entries.get(tile, {}).get(complaint_type)
+            if entry is None:
+                return None
+            etag, body, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[tile][complaint_type]
+                return None
+            self._entries.move_to_end(tile)
+            return etag, body
+
+    def put(self, tile, complaint_type, etag, body):
+        with self._lock:
+            self._entries.setdefault(tile, {})[complaint_type] = (etag, body, time.monotonic() + self.ttl)
+            self._entries.move_to_end(tile)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tiles):
+        with self._lock:
+            for tile in tiles:
+                self._entries.pop(tile, None)
+
+
+tile_cache = TileCache()
+
+
+def record_locations(db, complaints):
+    """Add newly inserted complaints that have coordinates to the heatmap."""
+    counts = _cell_counts(complaints)
+    if not counts:
+        return
+    _apply_counts(db[HEATMAP_COLLECTION], counts)
+    # Levels up to the max zoom are the tiles clients request
+    tile_cache.invalidate({(level, x, y) for level, x, y, _ in counts if level <= HEATMAP_MAX_ZOOM})
+
+
+def heatmap_tile(db, zoom, x, y, complaint_type=None):
+    """Binned complaint counts for one tile: ``GRID_SIZE`` bins a side, empty bins omitted."""
+    if not 0 <= zoom <= HEATMAP_MAX_ZOOM:
+        raise ValueError(f'zoom must be between 0 and {HEATMAP_MAX_ZOOM}')
+    if not (0 <= x < 1 << zoom and 0 <= y < 1 << zoom):
+        raise ValueError('Tile is outside the map')
+
+    field = f'by_type.{_type_key(complaint_type)}' if complaint_type else 'count'
+    cells = db[HEATMAP_COLLECTION].find(
+        {'level': zoom + GRID_BITS,
+         'x': {'$gte': x << GRID_BITS, '$lt': (x + 1) << GRID_BITS},
+         'y': {'$gte': y << GRID_BITS, '$lt': (y + 1) << GRID_BITS}},
+        {'x': 1, 'y': 1, field: 1}
+    )
+    bins = []
+    for cell in cells:
+        count = cell.get('by_type', {}).get(_type_key(complaint_type), 0) if complaint_type else cell['count']
+        if count:
+            bins.append({'x': cell['x'] - (x << GRID_BITS), 'y': cell['y'] - (y << GRID_BITS), 'count': count})
+    bins.sort(key=lambda b: (b['y'], b['x']))
+    return {
+        'z': zoom, 'x': x, 'y': y,
+        'bounds': tile_bounds(zoom, x, y),
+        'grid': GRID_SIZE,
+        'total': sum(b['count'] for b in bins),
+        'bins': bins
+    }
+
+
+def rebuild_heatmap(db, batch_size=REBUILD_BATCH_SIZE, progress=None):
+    """Recompute the pyramid into a scratch collection and swap it in.
+
+    Submissions made while it runs are lost at the swap, so run it during a
+    quiet period.
+    """
+    scratch = db[f'{HEATMAP_COLLECTION}_rebuild']
+    scratch.drop()
+    scratch.create_indexes(INDEXES[HEATMAP_COLLECTION])
+
+    processed = 0
+    for collection in (db.complaints, db[ARCHIVE_COLLECTION]):
+        last_id = None
+        while True:
+            query = {'geo': {'$exists': True}}
+            if last_id:
+                query['_id'] = {'$gt': last_id}
+            batch = list(collection.find(query, {'geo': 1, 'complaintType': 1}).sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            _apply_counts(scratch, _cell_counts(batch))
+            processed += len(batch)
+            last_id = batch[-1]['_id']
+            if progress:
+                progress(processed)
+
+    if processed:
+        scratch.rename(HEATMAP_COLLECTION, dropTarget=True)
+    else:
+        scratch.drop()
+        db[HEATMAP_COLLECTION].delete_many({})
+    return processed
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    if '--rebuild' not in sys.argv:
+        print('Usage: python geo.py --rebuild')
+        sys.exit(1)
+    db = get_db()
+    total = rebuild_heatmap(db, progress=lambda n: print(f'Processed {n} complaints'))
+    print(f'Rebuilt the heatmap from {total} located complaints')
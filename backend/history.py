@@ -0,0 +1,109 @@
+"""Append-only complaint status history.
+
+Every status update inserts one entry into ``complaint_status_history``
+(complaint id, previous and new status, remarks, who and when) instead of
+growing the complaint document; entries are never updated or deleted, and a
+bulk status change writes all of its entries with one ``insert_many``. Each
+entry also carries the complaint's route, bus, type and creation time, so
+the timeline and the time-in-status metrics never read ``complaints``.
+
+Only updates made after this collection was introduced are recorded.
+"""
+import statistics
+from datetime import timedelta
+from bson.objectid import ObjectId
+
+HISTORY_COLLECTION = 'complaint_status_history'
+# Status a complaint is created in; time in it starts at ``created_at``
+INITIAL_STATUS = 'pending'
+MAX_TIMELINE_ENTRIES = 500
+GROUPS = {'route': 'routeNumber', 'bus': 'busNumber', 'type': 'complaintType'}
+
+ENTRY_FIELDS = {'_id': 0, 'from_status': 1, 'to_status': 1, 'remarks': 1, 'changed_by': 1, 'changed_at': 1}
+
+
+def history_entry(complaint, changes, changed_by=None):
+    """Entry for ``complaint`` (as it was before the update) receiving ``changes``."""
+    return {
+        'complaint_id': complaint['_id'],
+        'from_status': complaint.get('status'),
+        'to_status': changes['status'],
+        'remarks': changes.get('remarks', ''),
+        'changed_by': changed_by,
+        'changed_at': changes['updated_at'],
+        'complaint_created_at': complaint.get('created_at'),
+        'routeNumber': complaint.get('routeNumber'),
+        'busNumber': complaint.get('busNumber'),
+        'complaintType': complaint.get('complaintType')
+    }
+
+
+def record_transitions(db, entries):
+    """Append history entries with a single write."""
+    if entries:
+        db[HISTORY_COLLECTION].insert_many(entries, ordered=False)
+
+
+def timeline(db, complaint_id, limit=MAX_TIMELINE_ENTRIES):
+    """A complaint's status changes, oldest first."""
+    return list(db[HISTORY_COLLECTION].find({'complaint_id': ObjectId(complaint_id)}, ENTRY_FIELDS)
+                .sort('changed_at', 1).limit(limit))
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_in_status(db, from_status, to_status, start_day, end_day, group='route', complaint_type=None):
+    """Seconds from entering ``from_status`` to reaching ``to_status``, per group.
+
+    Counts every move into ``to_status`` during the inclusive day window.
+    Each one is paired with the latest earlier entry into ``from_status`` of
+    the same complaint, or with the complaint's creation for the initial
+    status. Both steps use the history indexes.
+    """
+    match = {'to_status': to_status, 'from_status': {'$ne': to_status},
+             'changed_at': {'$gte': start_day, '$lt': end_day + timedelta(days=1)}}
+    if complaint_type:
+        match['complaintType'] = complaint_type
+    fallback = '$complaint_created_at' if from_status == INITIAL_STATUS else None
+
+    rows = db[HISTORY_COLLECTION].aggregate([
+        {'$match': match},
+        {'$lookup': {
+            'from': HISTORY_COLLECTION,
+            'let': {'complaint_id': '$complaint_id', 'changed_at': '$changed_at'},
+            'pipeline': [
+                {'$match': {'to_status': from_status, 'from_status': {'$ne': from_status},
+                            '$expr': {'$and': [{'$eq': ['$complaint_id', '$$complaint_id']},
+                                               {'$lt': ['$changed_at', '$$changed_at']}]}}},
+                {'$sort': {'changed_at': -1}},
+                {'$limit': 1},
+                {'$project': {'_id': 0, 'changed_at': 1}}
+            ],
+            'as': 'entered'
+        }},
+        {'$project': {
+            'group': f'${GROUPS[group]}',
+            'changed_at': 1,
+            'entered_at': {'$ifNull': [{'$arrayElemAt': ['$entered.changed_at', 0]}, fallback]}
+        }},
+        {'$match': {'entered_at': {'$ne': None}}},
+        {'$group': {
+            '_id': '$group',
+            'durations': {'$push': {'$divide': [{'$subtract': ['$changed_at', '$entered_at']}, 1000]}}
+        }}
+    ])
+
+    results = []
+    for row in rows:
+        durations = sorted(row['durations'])
+        results.append({
+            GROUPS[group]: row['_id'],
+            'count': len(durations),
+            'median_seconds': statistics.median(durations),
+            'p90_seconds': _percentile(durations, 0.9),
+            'mean_seconds': sum(durations) / len(durations)
+        })
+    results.sort(key=lambda result: result['median_seconds'], reverse=True)
+    return results
@@ -0,0 +1,218 @@
+"""Managed index set for the complaint system.
+
+``ensure_indexes`` is idempotent and is run at startup and at deploy time.
+``verify_query_plans`` explains every known query shape and reports any that
+would fall back to a collection scan.
+
+    python indexes.py            # create missing indexes
+    python indexes.py --verify   # create, then fail if any query shape COLLSCANs
+"""
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT, GEOSPHERE
+
+# get_all_complaints pages, unfiltered and filtered by status, type and/or
+# incident date; also on the archive for include_archived=true
+_ADMIN_LISTING_INDEXES = [
+    IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_id'),
+    IndexModel([('status', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+               name='status_created_id'),
+    IndexModel([('complaintType', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+               name='type_created_id'),
+    IndexModel([('status', ASCENDING), ('complaintType', ASCENDING),
+                ('created_at', DESCENDING), ('_id', DESCENDING)],
+               name='status_type_created_id'),
+    IndexModel([('incident_date', ASCENDING)], name='incident_date'),
+    # Radius and viewport queries; 2dsphere indexes skip complaints without coordinates
+    IndexModel([('geo', GEOSPHERE)], name='geo_2dsphere'),
+]
+
+# Admin keyword search; also on the archive for include_archived=true
+_TEXT_SEARCH_INDEX = IndexModel([('description', TEXT), ('location', TEXT)], name='description_location_text',
+                                weights={'description': 2, 'location': 1}, default_language='english')
+
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+    ],
+    'complaints': [
+        # Duplicate and retry detection in submit_complaint; sparse so complaints
+        # without these keys are left out of the unique constraint
+        IndexModel([('dedupe_key', ASCENDING)], name='dedupe_key_sparse_unique', unique=True, sparse=True),
+        IndexModel([('idempotency_key', ASCENDING)], name='idempotency_key_sparse_unique', unique=True,
+                   sparse=True),
+        # get_user_complaints
+        IndexModel([('user_email', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                   name='user_created_id'),
+        *_ADMIN_LISTING_INDEXES,
+        # Archiver: terminal complaints by age
+        IndexModel([('status', ASCENDING), ('updated_at', ASCENDING)], name='status_updated'),
+        # Orphan sweep: blobs still referenced by a complaint
+        IndexModel([('attachments.id', ASCENDING)], name='attachments_id', sparse=True),
+        _TEXT_SEARCH_INDEX,
+    ],
+    'complaints_archive': [
+        *_ADMIN_LISTING_INDEXES,
+        _TEXT_SEARCH_INDEX,
+        IndexModel([('attachments.id', ASCENDING)], name='attachments_id', sparse=True),
+    ],
+    'attachments.files': [
+        # Content-addressed attachment blobs
+        IndexModel([('sha256', ASCENDING)], name='sha256_unique', unique=True),
+        # Orphan sweep: blobs past the grace period
+        IndexModel([('uploadDate', ASCENDING)], name='upload_date'),
+    ],
+    'complaint_rollups': [
+        # Upsert target and top-N over a day window
+        IndexModel([('day', ASCENDING), ('routeNumber', ASCENDING),
+                    ('busNumber', ASCENDING), ('complaintType', ASCENDING)],
+                   name='day_route_bus_type_unique', unique=True),
+        # Per-route time series
+        IndexModel([('routeNumber', ASCENDING), ('day', ASCENDING)], name='route_day'),
+    ],
+    'complaint_heatmap': [
+        # Cells of one heatmap tile
+        IndexModel([('level', ASCENDING), ('x', ASCENDING), ('y', ASCENDING)], name='level_x_y'),
+    ],
+    'complaint_status_history': [
+        # Complaint timeline, and the time-in-status lookup of an earlier entry
+        IndexModel([('complaint_id', ASCENDING), ('changed_at', ASCENDING)], name='complaint_changed_at'),
+        # Time-in-status: moves into a status within a window
+        IndexModel([('to_status', ASCENDING), ('changed_at', ASCENDING)], name='to_status_changed_at'),
+    ],
+    'email_outbox': [
+        IndexModel([('status', ASCENDING), ('next_attempt_at', ASCENDING)],
+                   name='status_next_attempt'),
+        # Drops sent and failed messages once their retention has passed
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+}
+
+# Indexes replaced by the set above; dropped by ensure_indexes
+RETIRED_INDEXES = {
+    'complaints': ['user_created', 'created', 'status_created', 'type_created', 'status_type_created',
+                   'bus_route_type_created', 'dedupe_key_unique', 'idempotency_key_unique', 'date'],
+}
+
+# Representative instance of every query the API runs: (name, collection, filter, sort)
+_now = datetime(2024, 1, 1)
+QUERY_SHAPES = [
+    ('login/register/forgot-password user lookup', 'users',
+     {'email': 'user@example.com'}, None),
+    ('submit_complaint duplicate lookup', 'complaints',
+     {'dedupe_key': 'f' * 64}, None),
+    ('submit_complaint retry lookup', 'complaints',
+     {'idempotency_key': 'user@example.com:key'}, None),
+    ('get_user_complaints', 'complaints',
+     {'user_email': 'user@example.com'}, [('created_at', -1), ('_id', -1)]),
+    ('get_user_complaints next page', 'complaints',
+     {'$and': [{'user_email': 'user@example.com'},
+               {'$or': [{'created_at': {'$lt': _now}},
+                        {'created_at': _now, '_id': {'$lt': ObjectId()}}]}]},
+     [('created_at', -1), ('_id', -1)]),
+    ('get_all_complaints', 'complaints',
+     {}, [('created_at', -1), ('_id', -1)]),
+    ('get_all_complaints by status', 'complaints',
+     {'status': 'pending'}, [('created_at', -1), ('_id', -1)]),
+    ('get_all_complaints by type', 'complaints',
+     {'complaintType': 'Bus Delays'}, [('created_at', -1), ('_id', -1)]),
+    ('get_all_complaints by status and type', 'complaints',
+     {'status': 'pending', 'complaintType': 'Bus Delays'}, [('created_at', -1), ('_id', -1)]),
+    ('get_all_complaints by date', 'complaints',
+     {'incident_date': {'$gte': datetime(2024, 1, 1), '$lt': datetime(2024, 2, 1)}},
+     [('created_at', -1), ('_id', -1)]),
+    ('archiver eligible complaints', 'complaints',
+     {'status': {'$in': ['resolved', 'rejected']}, 'updated_at': {'$lt': _now}, 'schema_version': 2},
+     [('updated_at', 1)]),
+    ('archived complaints by status', 'complaints_archive',
+     {'status': 'resolved'}, [('created_at', -1), ('_id', -1)]),
+    ('attachment reference check', 'complaints',
+     {'attachments.id': ObjectId()}, None),
+    ('archived attachment reference check', 'complaints_archive',
+     {'attachments.id': ObjectId()}, None),
+    ('attachment dedupe lookup', 'attachments.files',
+     {'sha256': '0' * 64}, None),
+    ('admin keyword search', 'complaints',
+     {'$text': {'$search': 'rash driving'}, 'status': 'pending'}, None),
+    ('archived keyword search', 'complaints_archive',
+     {'$text': {'$search': 'rash driving'}, 'status': 'resolved'}, None),
+    ('admin complaints near a point', 'complaints',
+     {'geo': {'$geoWithin': {'$centerSphere': [[77.59, 12.97], 500 / 6378100]}}},
+     [('created_at', -1), ('_id', -1)]),
+    ('heatmap tile cells', 'complaint_heatmap',
+     {'level': 16, 'x': {'$gte': 0, '$lt': 16}, 'y': {'$gte': 0, '$lt': 16}}, None),
+    ('complaint timeline', 'complaint_status_history',
+     {'complaint_id': ObjectId()}, [('changed_at', 1)]),
+    ('time-in-status transitions', 'complaint_status_history',
+     {'to_status': 'resolved', 'changed_at': {'$gte': _now, '$lt': _now}}, None),
+    ('analytics top-N window', 'complaint_rollups',
+     {'day': {'$gte': _now, '$lte': _now}}, None),
+    ('analytics route time series', 'complaint_rollups',
+     {'routeNumber': '1', 'day': {'$gte': _now, '$lte': _now}}, None),
+    ('outbox claim', 'email_outbox',
+     {'$or': [{'status': 'queued', 'next_attempt_at': {'$lte': _now}},
+              {'status': 'sending', 'locked_at': {'$lt': _now}}]},
+     [('next_attempt_at', 1)]),
+]
+
+
+def ensure_indexes(db):
+    """Create every managed index that does not exist yet and drop retired ones."""
+    for collection, names in RETIRED_INDEXES.items():
+        existing = db[collection].index_information()
+        for name in names:
+            if name in existing:
+                db[collection].drop_index(name)
+
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = db[collection].create_indexes(models)
+    return created
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def explain_stages(db, collection, query, sort=None):
+    """Return the stage names of the winning plan for a query."""
+    cursor = db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    planner = cursor.explain()['queryPlanner']
+    return list(_plan_stages(planner['winningPlan']))
+
+
+def verify_query_plans(db, shapes=None):
+    """Explain each known query shape and return the names of those that COLLSCAN."""
+    failures = []
+    for name, collection, query, sort in shapes or QUERY_SHAPES:
+        if 'COLLSCAN' in explain_stages(db, collection, query, sort):
+            failures.append(name)
+    return failures
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    db = get_db()
+
+    for collection, names in ensure_indexes(db).items():
+        print(f'{collection}: {", ".join(names)}')
+
+    if '--verify' in sys.argv:
+        failures = verify_query_plans(db)
+        for name in failures:
+            print(f'COLLSCAN: {name}')
+        if failures:
+            sys.exit(1)
+        print(f'All {len(QUERY_SHAPES)} query shapes use an index')
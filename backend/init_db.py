@@ -1,6 +1,6 @@
 from pymongo import MongoClient
-from passlib.hash import pbkdf2_sha256
-from datetime import datetime
+from datetime import datetime, timezone
+from passwords import hash_password
 import os
 from dotenv import load_dotenv
 
@@ -21,7 +21,7 @@ def init_admin():
             admin = {
                 'name': 'Admin',
                 'email': 'admin@example.com',
-                'password': pbkdf2_sha256.hash('admin123'),
+                'password': hash_password('admin123'),
                 'role': 'admin',
                 'created_at': datetime.now(timezone.utc).isoformat()
             }
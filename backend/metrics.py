@@ -0,0 +1,159 @@
+"""Request, MongoDB and SMTP instrumentation exposed in Prometheus format.
+
+``init_app`` adds per-endpoint latency histograms and in-flight gauges and
+serves them on ``/metrics``. A pymongo command listener times every Mongo
+command by collection and operation, and ``smtp_phase`` times the SMTP
+connect/starttls/login/send phases. With SLOW_REQUEST_MS set, requests
+slower than that are logged together with the Mongo commands they ran.
+
+Under a pre-fork server, set PROMETHEUS_MULTIPROC_DIR to a shared empty
+directory so ``/metrics`` aggregates every worker.
+"""
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+from pymongo import monitoring
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ['method', 'endpoint', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests currently being served',
+    ['endpoint'], multiprocess_mode='livesum'
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command latency',
+    ['collection', 'command', 'outcome'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+EVENT_STREAMS = Gauge(
+    'sse_streams_open', 'Open Server-Sent Event streams',
+    ['stream'], multiprocess_mode='livesum'
+)
+RATE_LIMITED = Counter(
+    'http_requests_rate_limited_total', 'Requests refused by the rate limiter',
+    ['endpoint', 'scope']
+)
+SMTP_PHASE_LATENCY = Histogram(
+    'smtp_phase_duration_seconds', 'SMTP connect/starttls/login/send/quit latency',
+    ['phase', 'outcome'],
+    buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+
+# Commands whose first field does not name a collection
+_DATABASE_COMMANDS = {'ping', 'hello', 'isMaster', 'ismaster', 'buildInfo', 'endSessions',
+                      'saslStart', 'saslContinue', 'listCollections', 'listDatabases'}
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times each command and, inside a request, remembers it for the slow-request log."""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = '-'
+        if event.command_name not in _DATABASE_COMMANDS:
+            target = event.command.get(event.command_name)
+            if isinstance(target, str):
+                collection = target
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), '-')
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name, outcome).observe(seconds)
+        if has_request_context() and 'mongo_commands' in g:
+            g.mongo_commands.append((event.command_name, collection, seconds * 1000))
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'error')
+
+
+@contextmanager
+def smtp_phase(phase):
+    """Time one SMTP phase."""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        SMTP_PHASE_LATENCY.labels(phase, outcome).observe(time.perf_counter() - started)
+
+
+_listener_installed = False
+
+
+def install_mongo_listener():
+    """Register the command listener; must run before the MongoClient is created."""
+    global _listener_installed
+    if not _listener_installed:
+        monitoring.register(MongoCommandTimer())
+        _listener_installed = True
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.mongo_commands = []
+    g.metrics_endpoint = _endpoint()
+    REQUESTS_IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+
+def _after_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    REQUEST_LATENCY.labels(request.method, g.metrics_endpoint, str(response.status_code)).observe(elapsed)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        commands = ', '.join(f'{name} {collection} {ms:.1f}ms' for name, collection, ms in g.mongo_commands)
+        path = request.full_path.rstrip('?')
+        logger.warning(f'Slow request {request.method} {path} {response.status_code} '
+                       f'{elapsed * 1000:.1f}ms; mongo: {commands or "none"}')
+    return response
+
+
+def _teardown_request(exc):
+    if 'metrics_endpoint' in g:
+        REQUESTS_IN_FLIGHT.labels(g.metrics_endpoint).dec()
+
+
+def metrics_view():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    install_mongo_listener()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,134 @@
+"""Bring stored complaints up to the current schema.
+
+Rewrites complaints whose ``schema_version`` is older than
+``complaints.SCHEMA_VERSION``: ISO-string ``created_at``/``updated_at``
+become BSON datetimes, ``date`` is normalized to ``YYYY-MM-DD`` and
+``incident_date`` is added. Documents are read in ``_id`` order and written
+with one unordered ``bulk_write`` per batch, pausing between batches to
+leave headroom for live traffic. The last ``_id`` handled is checkpointed in
+``migrations``, so an interrupted run resumes where it stopped. The archive
+is migrated after the live collection, so archived complaints can be
+restored.
+
+    python migrate.py                         # run or resume
+    python migrate.py --batch-size 200 --pause-ms 500
+    python migrate.py --restart               # ignore the checkpoint
+"""
+import time
+from datetime import datetime
+from pymongo import UpdateOne
+from complaints import SCHEMA_VERSION, ensure_schema, normalize_timestamp, parse_incident_date
+from archive import ARCHIVE_COLLECTION
+
+MIGRATED_COLLECTIONS = ['complaints', ARCHIVE_COLLECTION]
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE_MS = 100
+
+PROJECTION = {'date': 1, 'created_at': 1, 'updated_at': 1}
+
+
+def canonical_fields(complaint):
+    """Return ``(fields to $set, incident date was inferred)`` for a stored complaint."""
+    created_at = normalize_timestamp(complaint.get('created_at'))
+    if created_at is None:
+        created_at = complaint['_id'].generation_time.replace(tzinfo=None)
+    updated_at = normalize_timestamp(complaint.get('updated_at')) or created_at
+
+    inferred = False
+    try:
+        incident_date = parse_incident_date(complaint.get('date'))
+    except ValueError:
+        parsed = normalize_timestamp(complaint.get('date'))
+        if parsed is None:
+            # Unreadable incident date: fall back to the day it was reported
+            parsed, inferred = created_at, True
+        incident_date = datetime(parsed.year, parsed.month, parsed.day)
+
+    return {
+        'date': incident_date.strftime('%Y-%m-%d'),
+        'incident_date': incident_date,
+        'created_at': created_at,
+        'updated_at': updated_at,
+        'schema_version': SCHEMA_VERSION
+    }, inferred
+
+
+def migration_id(collection_name):
+    return f'{collection_name}_schema_v{SCHEMA_VERSION}'
+
+
+def migrate(db, batch_size=DEFAULT_BATCH_SIZE, pause_ms=DEFAULT_PAUSE_MS, restart=False, progress=None,
+            collection_name='complaints'):
+    """Migrate outdated complaints in batches; returns the final checkpoint document."""
+    ensure_schema(db)
+    collection = db[collection_name]
+    migration = migration_id(collection_name)
+    pending = {'$or': [{'schema_version': {'$exists': False}},
+                       {'schema_version': {'$lt': SCHEMA_VERSION}}]}
+
+    checkpoint = None if restart else db.migrations.find_one({'_id': migration})
+    if checkpoint is None or checkpoint.get('completed_at'):
+        checkpoint = {'_id': migration, 'last_id': None, 'migrated': 0, 'inferred_dates': 0,
+                      'started_at': datetime.utcnow(), 'completed_at': None}
+    total = checkpoint['migrated'] + collection.count_documents(
+        {'$and': [pending, {'_id': {'$gt': checkpoint['last_id']}}]} if checkpoint['last_id'] else pending)
+
+    started = time.monotonic()
+    migrated_this_run = 0
+    while True:
+        query = pending
+        if checkpoint['last_id']:
+            query = {'$and': [pending, {'_id': {'$gt': checkpoint['last_id']}}]}
+        batch = list(collection.find(query, PROJECTION).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+
+        requests = []
+        for complaint in batch:
+            fields, inferred = canonical_fields(complaint)
+            checkpoint['inferred_dates'] += inferred
+            # The version guard keeps a concurrent writer's newer document intact
+            requests.append(UpdateOne({'_id': complaint['_id'], **pending}, {'$set': fields}))
+        collection.bulk_write(requests, ordered=False)
+
+        checkpoint['last_id'] = batch[-1]['_id']
+        checkpoint['migrated'] += len(batch)
+        migrated_this_run += len(batch)
+        db.migrations.replace_one({'_id': migration}, checkpoint, upsert=True)
+
+        if progress:
+            elapsed = time.monotonic() - started
+            rate = migrated_this_run / elapsed if elapsed else 0
+            remaining = max(0, total - checkpoint['migrated'])
+            progress(checkpoint['migrated'], total, rate, remaining / rate if rate else None)
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
+
+    checkpoint['completed_at'] = datetime.utcnow()
+    db.migrations.replace_one({'_id': migration}, checkpoint, upsert=True)
+    return checkpoint
+
+
+def _print_progress(done, total, rate, eta):
+    eta_text = f', ~{eta:.0f}s left' if eta is not None else ''
+    print(f'Migrated {done}/{total} complaints ({rate:.0f}/s{eta_text})')
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import get_db
+
+    parser = argparse.ArgumentParser(description='Migrate complaints to the current schema')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pause-ms', type=int, default=DEFAULT_PAUSE_MS,
+                        help='sleep between batches to limit load on the primary')
+    parser.add_argument('--restart', action='store_true', help='start over instead of resuming')
+    args = parser.parse_args()
+
+    db = get_db()
+    for name in MIGRATED_COLLECTIONS:
+        print(f'Migrating {name}')
+        result = migrate(db, args.batch_size, args.pause_ms, args.restart, progress=_print_progress,
+                         collection_name=name)
+        print(f"Done: {result['migrated']} documents in {name} at schema v{SCHEMA_VERSION}, "
+              f"{result['inferred_dates']} incident dates inferred from the submission time")
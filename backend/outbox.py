@@ -0,0 +1,206 @@
+"""Durable email outbox.
+
+Request handlers call ``enqueue_email`` to record a message in the
+``email_outbox`` collection and return immediately. Worker threads claim
+queued messages one at a time, send them over the pooled SMTP sessions in
+``email_service`` and retry failures with exponential backoff.
+
+Sent and failed messages get an ``expires_at``; a TTL index removes them
+after ``OUTBOX_SENT_RETENTION_DAYS`` / ``OUTBOX_FAILED_RETENTION_DAYS``, so
+the collection only grows with the backlog, not with every email ever sent.
+
+Run ``python outbox.py`` to drain the outbox from a dedicated process, and
+``python outbox.py --expire-finished`` once to schedule rows finished before
+the TTL existed.
+"""
+import os
+import random
+import socket
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from email_service import send_email, get_smtp_pool
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+BASE_BACKOFF_SECONDS = float(os.getenv('OUTBOX_BASE_BACKOFF_SECONDS', 5))
+MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', 900))
+# A message stuck in 'sending' longer than this is assumed orphaned by a dead worker
+LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 120))
+POLL_INTERVAL_SECONDS = float(os.getenv('OUTBOX_POLL_INTERVAL_SECONDS', 1))
+# How long finished messages are kept for inspection before the TTL index drops them
+SENT_RETENTION_DAYS = float(os.getenv('OUTBOX_SENT_RETENTION_DAYS', 7))
+FAILED_RETENTION_DAYS = float(os.getenv('OUTBOX_FAILED_RETENTION_DAYS', 30))
+RETENTION_DAYS = {'sent': SENT_RETENTION_DAYS, 'failed': FAILED_RETENTION_DAYS}
+
+
+def _outbox_document(kind, recipient_email, payload, now):
+    return {
+        'kind': kind,
+        'recipient': recipient_email,
+        'payload': payload,
+        'status': 'queued',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now
+    }
+
+
+def enqueue_email(db, kind, recipient_email, payload):
+    """Queue an email for background delivery and return its outbox id."""
+    document = _outbox_document(kind, recipient_email, payload, datetime.utcnow())
+    return db.email_outbox.insert_one(document).inserted_id
+
+
+def enqueue_emails(db, messages):
+    """Queue several ``(kind, recipient_email, payload)`` emails with one insert."""
+    if not messages:
+        return []
+    now = datetime.utcnow()
+    documents = [_outbox_document(kind, recipient, payload, now) for kind, recipient, payload in messages]
+    return db.email_outbox.insert_many(documents, ordered=False).inserted_ids
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retry number ``attempts``, with full jitter."""
+    ceiling = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** (attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim_next(db, worker_id):
+    """Atomically move the next due message to 'sending' and return it."""
+    now = datetime.utcnow()
+    return db.email_outbox.find_one_and_update(
+        {'$or': [
+            {'status': 'queued', 'next_attempt_at': {'$lte': now}},
+            {'status': 'sending', 'locked_at': {'$lt': now - timedelta(seconds=LEASE_SECONDS)}}
+        ]},
+        {'$set': {'status': 'sending', 'locked_at': now, 'locked_by': worker_id}},
+        sort=[('next_attempt_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def process_one(db, worker_id, pool=None):
+    """Send one due message. Returns False when nothing was due."""
+    job = claim_next(db, worker_id)
+    if not job:
+        return False
+
+    try:
+        send_email(job['kind'], job['recipient'], job['payload'], pool=pool)
+    except Exception as e:
+        attempts = job['attempts'] + 1
+        update = {'attempts': attempts, 'last_error': str(e)}
+        if attempts >= MAX_ATTEMPTS:
+            update['status'] = 'failed'
+            update['expires_at'] = datetime.utcnow() + timedelta(days=FAILED_RETENTION_DAYS)
+            logger.error(f"Giving up on {job['kind']} email to {job['recipient']} after {attempts} attempts: {str(e)}")
+        else:
+            update['status'] = 'queued'
+            update['next_attempt_at'] = datetime.utcnow() + timedelta(seconds=backoff_delay(attempts))
+            logger.warning(f"Failed to send {job['kind']} email to {job['recipient']} (attempt {attempts}): {str(e)}")
+        db.email_outbox.update_one(
+            {'_id': job['_id'], 'locked_by': worker_id},
+            {'$set': update, '$unset': {'locked_at': '', 'locked_by': ''}}
+        )
+        return True
+
+    sent_at = datetime.utcnow()
+    db.email_outbox.update_one(
+        {'_id': job['_id'], 'locked_by': worker_id},
+        {
+            '$set': {'status': 'sent', 'sent_at': sent_at, 'attempts': job['attempts'] + 1,
+                     'expires_at': sent_at + timedelta(days=SENT_RETENTION_DAYS)},
+            '$unset': {'locked_at': '', 'locked_by': ''}
+        }
+    )
+    return True
+
+
+def expire_finished(db):
+    """Give finished messages that predate the TTL an ``expires_at``; returns how many."""
+    now = datetime.utcnow()
+    updated = 0
+    for status, days in RETENTION_DAYS.items():
+        updated += db.email_outbox.update_many(
+            {'status': status, 'expires_at': {'$exists': False}},
+            {'$set': {'expires_at': now + timedelta(days=days)}}
+        ).modified_count
+    return updated
+
+
+def drain(db, pool=None, worker_id=None):
+    """Send every message that is currently due and return how many were handled."""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:drain'
+    handled = 0
+    while process_one(db, worker_id, pool=pool):
+        handled += 1
+    return handled
+
+
+class OutboxWorker(threading.Thread):
+    """Daemon thread that keeps draining the outbox until stopped."""
+
+    def __init__(self, db, index=0, pool=None, poll_interval=POLL_INTERVAL_SECONDS):
+        super().__init__(name=f'outbox-worker-{index}', daemon=True)
+        self.db = db
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{index}'
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                if process_one(self.db, self.worker_id, pool=self.pool):
+                    continue
+            except Exception as e:
+                logger.error(f'Outbox worker error: {str(e)}')
+            self._stop_event.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_workers(db, count=None, pool=None):
+    """Start ``count`` outbox worker threads sharing one SMTP pool."""
+    if count is None:
+        count = int(os.getenv('OUTBOX_WORKERS', 2))
+    pool = pool or get_smtp_pool()
+    workers = [OutboxWorker(db, index=i, pool=pool) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import get_db
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Deliver queued emails from the outbox')
+    parser.add_argument('--once', action='store_true', help='send everything currently due and exit')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker threads')
+    parser.add_argument('--expire-finished', action='store_true',
+                        help='schedule sent/failed messages from before the TTL index for removal and exit')
+    args = parser.parse_args()
+
+    db = get_db()
+    if args.expire_finished:
+        print(f'Scheduled {expire_finished(db)} finished emails for removal')
+    elif args.once:
+        print(f'Sent {drain(db)} queued emails')
+    else:
+        workers = start_workers(db, args.workers)
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.stop()
+            get_smtp_pool().close()
@@ -0,0 +1,122 @@
+"""Keyset pagination and field projection for complaint listings.
+
+Pages are ordered by ``(created_at, _id)`` descending. ``next_cursor`` is an
+opaque token holding the sort key of the last document on the page, so each
+page is a bounded index range scan no matter how deep the client has paged.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+SORT = [('created_at', -1), ('_id', -1)]
+
+# Fields a client may request with ?fields=
+COMPLAINT_FIELDS = {
+    'busNumber', 'routeNumber', 'complaintType', 'description', 'location',
+    'date', 'status', 'remarks', 'user_email', 'created_at', 'updated_at', 'attachments', 'geo'
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_token(data):
+    """Pack a small dict into an opaque URL-safe token."""
+    raw = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Unpack a token built by ``encode_token``. Raises ValueError."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(data, dict):
+        raise ValueError('Invalid cursor')
+    return data
+
+
+def encode_cursor(document):
+    """Build the opaque cursor that resumes after ``document``."""
+    millis = (document['created_at'] - _EPOCH) // timedelta(milliseconds=1)
+    return encode_token({'t': millis, 'id': str(document['_id'])})
+
+
+def decode_cursor(cursor):
+    """Return the ``(created_at, _id)`` key stored in a cursor."""
+    data = decode_token(cursor)
+    try:
+        return _EPOCH + timedelta(milliseconds=int(data['t'])), ObjectId(data['id'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError('Invalid cursor')
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    return min(limit, MAX_LIMIT)
+
+
+def parse_fields(value):
+    """Turn ``?fields=a,b`` into a projection, or None for full documents."""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in COMPLAINT_FIELDS]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    # created_at is always returned because the cursor is built from it
+    projection = {field: 1 for field in fields}
+    projection['created_at'] = 1
+    return projection
+
+
+def after_cursor(query, cursor):
+    """Restrict ``query`` to documents that sort after ``cursor``."""
+    created_at, last_id = decode_cursor(cursor)
+    keyset = {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': last_id}}
+    ]}
+    return {'$and': [query, keyset]} if query else keyset
+
+
+def paginate(collection, query, args, projection=None):
+    """Fetch one page of ``query`` using the ``limit``, ``cursor`` and ``fields`` args.
+
+    ``collection`` may be a list of collections sharing the sort key, whose
+    pages are merged. ``projection`` overrides ``fields`` (it must include
+    ``created_at``). Returns ``(documents, next_cursor)``; ``next_cursor`` is
+    None on the last page. Raises ValueError for malformed arguments.
+    """
+    limit = parse_limit(args.get('limit'))
+    fields = parse_fields(args.get('fields'))
+    if projection is None:
+        projection = fields
+    if args.get('cursor'):
+        query = after_cursor(query, args['cursor'])
+
+    # Read one extra document to learn whether another page exists
+    collections = collection if isinstance(collection, list) else [collection]
+    documents = []
+    for source in collections:
+        documents.extend(source.find(query, projection).sort(SORT).limit(limit + 1))
+    if len(collections) > 1:
+        documents.sort(key=lambda document: (document['created_at'], document['_id']), reverse=True)
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1])
+    return documents, next_cursor
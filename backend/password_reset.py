@@ -2,7 +2,7 @@ from datetime import datetime, timedelta
 import jwt
 import os
 from email_service import send_password_reset_email
-from passlib.hash import pbkdf2_sha256
+from passwords import hash_password, HasherBusy
 
 def generate_reset_token(email):
     """Generate a password reset token."""
@@ -29,12 +29,14 @@ def verify_reset_token(token):
 def update_password(db, email, new_password):
     """Update user's password in the database."""
     try:
-        hashed_password = pbkdf2_sha256.hash(new_password)
+        hashed_password = hash_password(new_password)
         result = db.users.update_one(
             {'email': email},
             {'$set': {'password': hashed_password}}
         )
         return result.modified_count > 0
+    except HasherBusy:
+        raise
     except Exception as e:
         print(f'Error updating password: {str(e)}')
         return False
\ No newline at end of file
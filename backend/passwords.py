@@ -0,0 +1,163 @@
+"""Password hashing off the request thread.
+
+PBKDF2 runs in a bounded process pool so a burst of logins cannot pin the
+web workers' CPU. At most ``PASSWORD_HASH_QUEUE_LIMIT`` hash/verify jobs may
+be pending at once; beyond that, or when a job does not finish within
+``PASSWORD_HASH_TIMEOUT_SECONDS``, ``HasherBusy`` is raised and the route
+answers 503. A job keeps its slot until it actually completes, so requests
+that gave up waiting still count against the limit. Pool processes are
+started with forkserver (or spawn), never forked from the multithreaded web
+worker. Hashes created with a different round count are upgraded in
+the background after a successful login.
+
+    python passwords.py --benchmark   # logins/sec per core for several round counts
+"""
+import os
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import jsonify
+from passlib.hash import pbkdf2_sha256
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS', pbkdf2_sha256.default_rounds))
+# 0 hashes inline on the calling thread (useful for local development)
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', PASSWORD_HASH_WORKERS * 8 or 1))
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv('PASSWORD_HASH_TIMEOUT_SECONDS', 10))
+RETRY_AFTER_SECONDS = 1
+
+
+class HasherBusy(Exception):
+    """Raised when too many hash/verify jobs are already pending."""
+
+
+def _hasher(rounds):
+    return pbkdf2_sha256.using(rounds=rounds, min_desired_rounds=rounds, max_desired_rounds=rounds)
+
+
+def _hash(password, rounds):
+    return _hasher(rounds).hash(password)
+
+
+def _verify(password, password_hash, rounds):
+    hasher = _hasher(rounds)
+    if not hasher.verify(password, password_hash):
+        return False, False
+    return True, hasher.needs_update(password_hash)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE_LIMIT)
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='password-rehash')
+
+
+def _get_pool():
+    """Return this process's hashing pool, creating it after any fork."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Forking a process that already runs outbox and DNS threads can deadlock
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context(method))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HasherBusy()
+    if PASSWORD_HASH_WORKERS == 0:
+        try:
+            return fn(*args)
+        finally:
+            _slots.release()
+
+    try:
+        future = _get_pool().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    # Release when the job is done or cancelled, not when this caller stops waiting
+    future.add_done_callback(lambda f: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        # Drop it if it has not started; a running job keeps its slot until it ends
+        future.cancel()
+        raise HasherBusy()
+
+
+def hash_password(password):
+    """Hash a password with the configured cost. May raise HasherBusy."""
+    return _run(_hash, password, PASSWORD_HASH_ROUNDS)
+
+
+def verify_password(password, password_hash):
+    """Return ``(matches, needs_rehash)``. May raise HasherBusy."""
+    return _run(_verify, password, password_hash, PASSWORD_HASH_ROUNDS)
+
+
+def schedule_rehash(db, user_id, password, old_hash):
+    """Replace ``old_hash`` with one at the configured cost, off the request path."""
+    def rehash():
+        try:
+            new_hash = hash_password(password)
+        except HasherBusy:
+            # The next login will try again
+            return
+        # Only replace the hash if the password was not changed meanwhile
+        db.users.update_one({'_id': user_id, 'password': old_hash}, {'$set': {'password': new_hash}})
+
+    future = _background.submit(rehash)
+    future.add_done_callback(
+        lambda f: f.exception() and logger.error(f'Password rehash failed: {str(f.exception())}')
+    )
+
+
+def busy_response(operation):
+    """503 for a ``HasherBusy`` raised while handling ``operation`` (e.g. 'sign-in')."""
+    response = jsonify({
+        'error': 'Server busy',
+        'details': f'Too many {operation} requests are being processed. Please try again shortly.'
+    })
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response, 503
+
+
+def benchmark(rounds_options, duration=2.0):
+    """Measure single-core verifications per second for each round count."""
+    import time
+
+    results = {}
+    for rounds in rounds_options:
+        password_hash = _hash('benchmark-password', rounds)
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < duration:
+            _verify('benchmark-password', password_hash, rounds)
+            count += 1
+        results[rounds] = count / (time.perf_counter() - started)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Password hashing utilities')
+    parser.add_argument('--benchmark', action='store_true', help='report logins/sec per core')
+    parser.add_argument('--rounds', type=int, nargs='+',
+                        default=[10000, 29000, 100000, PASSWORD_HASH_ROUNDS])
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per setting')
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+    else:
+        for rounds, rate in benchmark(sorted(set(args.rounds)), args.duration).items():
+            print(f'rounds={rounds:>7}  {rate:8.1f} logins/sec/core')
@@ -0,0 +1,262 @@
+"""Token-bucket admission control for the burst-prone endpoints.
+
+Each limited endpoint has up to three buckets: one per user (the token's
+email, or the email in the request body for sign-in routes), one per client
+IP and one for the endpoint as a whole. A request is admitted only if every
+bucket has a token, and then one token is taken from each.
+
+Buckets live in a small memory-mapped file, so every worker process on the
+host shares them; a request costs one lock and a handful of slot reads. The
+file defaults to a directory only the service's user can write
+(``$XDG_RUNTIME_DIR``, else a 0700 directory in the temp dir), so other
+local users cannot create or truncate it.
+
+The IP bucket keys on ``request.remote_addr``; behind a reverse proxy set
+``TRUSTED_PROXY_HOPS`` so ``create_app`` restores the client address, or
+every client shares the proxy's bucket.
+Limits are written ``count/period`` (``10/minute``) and can be overridden with
+``RATE_LIMIT_<ENDPOINT>_<SCOPE>`` environment variables, e.g.
+``RATE_LIMIT_LOGIN_IP=30/minute`` or ``RATE_LIMIT_LOGIN_IP=off``.
+"""
+import hashlib
+import math
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, jsonify, request
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are only locked within a process
+    fcntl = None
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+# Unset: ratelimit.bin in the directory chosen by _private_dir
+RATE_LIMIT_STATE_FILE = os.getenv('RATE_LIMIT_STATE_FILE')
+RATE_LIMIT_SLOTS = int(os.getenv('RATE_LIMIT_SLOTS', 65536))
+
+RATE_LIMITS = {
+    'login': {'user': '5/minute', 'ip': '20/minute', 'global': '50/second'},
+    'forgot_password': {'user': '3/hour', 'ip': '5/minute', 'global': '5/second'},
+    'submit_complaint': {'user': '20/minute', 'ip': '60/minute', 'global': '200/second'},
+    'submit_batch': {'user': '5/minute', 'ip': '10/minute', 'global': '5/second'},
+}
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# key hash, tokens left, last update (epoch seconds); a zero hash marks a free slot
+SLOT = struct.Struct('<Qdd')
+PROBES = 8
+
+
+class Limit(namedtuple('Limit', 'capacity period')):
+    @property
+    def rate(self):
+        return self.capacity / self.period
+
+
+def parse_rate(spec):
+    """Parse ``count/period`` into a Limit, or None for ``off``."""
+    if spec.strip().lower() == 'off':
+        return None
+    try:
+        count, period = spec.split('/')
+        return Limit(int(count), _PERIODS[period.strip().lower()])
+    except (ValueError, KeyError):
+        raise ValueError(f'Invalid rate limit {spec!r}, expected e.g. 10/minute')
+
+
+def configured_limits(name):
+    """The ``{scope: Limit}`` buckets for an endpoint, with env overrides applied."""
+    limits = {}
+    for scope, spec in RATE_LIMITS[name].items():
+        limit = parse_rate(os.getenv(f'RATE_LIMIT_{name}_{scope}'.upper(), spec))
+        if limit:
+            limits[scope] = limit
+    return limits
+
+
+LIMITS = {name: configured_limits(name) for name in RATE_LIMITS}
+
+
+@contextmanager
+def _file_lock(fd):
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _private_dir():
+    """A directory only this user can write, created on first use."""
+    if not hasattr(os, 'getuid'):  # Windows: the temp dir is already per user
+        return tempfile.gettempdir()
+    if os.getenv('XDG_RUNTIME_DIR'):
+        path = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'bus-complaint')
+    else:
+        path = os.path.join(tempfile.gettempdir(), f'bus-complaint-{os.getuid()}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    # Someone else may have created it first; refuse rather than share it
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f'{path} is not a private directory of this user; set RATE_LIMIT_STATE_FILE')
+    return path
+
+
+def _key_hash(key):
+    value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+    return value or 1
+
+
+class BucketStore:
+    """Fixed-size open-addressed table of token buckets in a shared file.
+
+    When every probed slot is taken, the least recently used one is reused;
+    the evicted key simply starts again from a full bucket.
+    """
+
+    def __init__(self, path=RATE_LIMIT_STATE_FILE, slots=RATE_LIMIT_SLOTS):
+        # None: ratelimit.bin in a private directory, resolved when first opened
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._pid = None
+
+    def _open(self):
+        # flock is held per open file, so each forked worker opens its own
+        if self._pid == os.getpid():
+            return
+        if self._fd is not None:
+            self._map.close()
+            os.close(self._fd)
+        if self.path is None:
+            self.path = os.path.join(_private_dir(), 'ratelimit.bin')
+        size = self.slots * SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        with _file_lock(fd):
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _find(self, key_hash, claimed):
+        """Return the slot for ``key_hash`` and whether it already holds it."""
+        start = key_hash % self.slots
+        victim, victim_updated = None, None
+        for probe in range(PROBES):
+            slot = (start + probe) % self.slots
+            if slot in claimed:
+                continue
+            stored, _, updated = SLOT.unpack_from(self._map, slot * SLOT.size)
+            if stored == key_hash:
+                return slot, True
+            if stored == 0:
+                return slot, False
+            if victim is None or updated < victim_updated:
+                victim, victim_updated = slot, updated
+        return victim, False
+
+    def acquire(self, buckets):
+        """Take a token from every ``(key, limit)`` bucket, or from none of them.
+
+        Returns ``(0, None)`` when admitted, otherwise the seconds until the
+        request would be admitted and the key that refused it.
+        """
+        now = time.time()
+        with self._lock:
+            self._open()
+            with _file_lock(self._fd):
+                updates = []
+                retry_after, refused = 0, None
+                for key, limit in buckets:
+                    key_hash = _key_hash(key)
+                    slot, found = self._find(key_hash, {update[0] for update in updates})
+                    tokens = limit.capacity
+                    if found:
+                        _, tokens, updated = SLOT.unpack_from(self._map, slot * SLOT.size)
+                        tokens = min(limit.capacity, tokens + max(0.0, now - updated) * limit.rate)
+                    if tokens < 1:
+                        wait = (1 - tokens) / limit.rate
+                        if wait > retry_after:
+                            retry_after, refused = wait, key
+                    updates.append((slot, key_hash, tokens - 1))
+                if refused is not None:
+                    return retry_after, refused
+                for slot, key_hash, tokens in updates:
+                    SLOT.pack_into(self._map, slot * SLOT.size, key_hash, tokens, now)
+        return 0, None
+
+
+store = BucketStore()
+
+
+def _identity():
+    if 'user' in g:
+        return g.user.get('email')
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('email'), str):
+        return data['email'].strip().lower() or None
+    return None
+
+
+def check(name):
+    """Admit or refuse the current request against ``name``'s buckets.
+
+    Returns ``(retry_after_seconds, scope)``; zero seconds means admitted.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return 0, None
+    subjects = {'user': _identity(), 'ip': request.remote_addr, 'global': ''}
+    buckets = [(f'{name}:{scope}:{subjects[scope]}', limit)
+               for scope, limit in LIMITS[name].items()
+               if subjects[scope] is not None]
+    retry_after, refused = store.acquire(buckets)
+    if not retry_after:
+        return 0, None
+    scope = refused.split(':')[1]
+    metrics.RATE_LIMITED.labels(name, scope).inc()
+    return retry_after, scope
+
+
+def limited_response(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({
+        'error': 'Too many requests',
+        'details': f'Please try again in {seconds} seconds.'
+    })
+    response.headers['Retry-After'] = str(seconds)
+    return response, 429
+
+
+def rate_limited(name):
+    """Refuse requests over ``name``'s limits with 429 and Retry-After.
+
+    Place it below ``login_required`` so the per-user bucket uses the token.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            retry_after, _ = check(name)
+            if retry_after:
+                return limited_response(retry_after)
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
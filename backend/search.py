@@ -0,0 +1,107 @@
+"""Full-text complaint search over ``description`` and ``location``.
+
+Backed by the collection's text index. Results are ranked by text score and
+paged with a ``(score, _id)`` keyset cursor; each hit carries short
+highlighted snippets of the fields that matched. The archive has the same
+text index, so ``include_archived`` searches both collections and merges
+their pages.
+"""
+import html
+import re
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pagination import decode_token, encode_token, parse_limit
+
+SNIPPET_RADIUS = 60
+RESULT_FIELDS = ['busNumber', 'routeNumber', 'complaintType', 'description', 'location',
+                 'date', 'status', 'user_email', 'created_at', 'updated_at', 'attachments', 'geo']
+
+
+def search_terms(q):
+    """Words and phrases to highlight; negated terms are left out."""
+    phrases = re.findall(r'"([^"]+)"', q)
+    rest = re.sub(r'"[^"]*"', ' ', q)
+    words = [w for w in rest.split() if not w.startswith('-')]
+    return [p.strip() for p in phrases if p.strip()] + words
+
+
+def _term_pattern(terms):
+    # The text index stems words ("driving" matches "drive"), so highlight by prefix
+    parts = []
+    for term in terms:
+        if ' ' in term:
+            parts.append(re.escape(term))
+        else:
+            stem = term[:max(3, len(term) - 3)]
+            parts.append(re.escape(stem) + r'\w*')
+    return re.compile(r'\b(' + '|'.join(parts) + r')', re.IGNORECASE) if parts else None
+
+
+def highlight(text, pattern, radius=SNIPPET_RADIUS):
+    """HTML-escaped snippet around the first match with matches wrapped in <mark>."""
+    if not text or pattern is None:
+        return None
+    text = str(text)
+    match = pattern.search(text)
+    if not match:
+        return None
+    start = max(0, match.start() - radius)
+    end = min(len(text), match.end() + radius)
+    snippet = text[start:end]
+    marked = []
+    last = 0
+    for m in pattern.finditer(snippet):
+        marked.append(html.escape(snippet[last:m.start()]))
+        marked.append(f'<mark>{html.escape(m.group(0))}</mark>')
+        last = m.end()
+    marked.append(html.escape(snippet[last:]))
+    return ('…' if start else '') + ''.join(marked) + ('…' if end < len(text) else '')
+
+
+def search_complaints(collection, q, filters, args):
+    """Return ``(hits, next_cursor)`` for a text query combined with ``filters``.
+
+    ``collection`` may be a list of collections with the same text index,
+    whose pages are merged. Raises ValueError for malformed arguments.
+    """
+    limit = parse_limit(args.get('limit'))
+    match = {**filters, '$text': {'$search': q}}
+    pipeline = [
+        {'$match': match},
+        {'$project': {**{field: 1 for field in RESULT_FIELDS}, 'score': {'$meta': 'textScore'}}},
+    ]
+    if args.get('cursor'):
+        data = decode_token(args['cursor'])
+        try:
+            score, last_id = float(data['s']), ObjectId(data['id'])
+        except (KeyError, TypeError, ValueError, InvalidId):
+            raise ValueError('Invalid cursor')
+        pipeline.append({'$match': {'$or': [
+            {'score': {'$lt': score}},
+            {'score': score, '_id': {'$lt': last_id}}
+        ]}})
+    pipeline += [
+        {'$sort': {'score': -1, '_id': -1}},
+        {'$limit': limit + 1}
+    ]
+
+    collections = collection if isinstance(collection, list) else [collection]
+    hits = []
+    for source in collections:
+        hits.extend(source.aggregate(pipeline))
+    if len(collections) > 1:
+        hits.sort(key=lambda hit: (hit['score'], hit['_id']), reverse=True)
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_token({'s': hits[-1]['score'], 'id': str(hits[-1]['_id'])})
+
+    pattern = _term_pattern(search_terms(q))
+    for hit in hits:
+        hit['highlights'] = {
+            field: snippet for field in ('description', 'location')
+            if (snippet := highlight(hit.get(field), pattern))
+        }
+        # Only the snippet is returned for the long free-text field
+        hit.pop('description', None)
+    return hits, next_cursor
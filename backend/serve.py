@@ -0,0 +1,107 @@
+"""Production entry point: a gunicorn pre-fork server around ``create_app()``.
+
+    python serve.py                      # WEB_CONCURRENCY workers on 0.0.0.0:5000
+    python serve.py --workers 8 --bind 0.0.0.0:8000
+
+The app is imported once in the master and shared by the forked workers.
+The master ensures indexes with a short-lived client and closes it before
+forking; each worker opens its own MongoClient on its first request.
+
+With ``--worker-class gevent`` (the supported setup for many open event
+streams) the standard library is monkey-patched before anything else is
+imported, since ``preload_app`` imports the app in the master.
+"""
+import os
+import sys
+
+if os.getenv('WEB_WORKER_CLASS') == 'gevent' or any(
+        arg in ('gevent', '--worker-class=gevent') for arg in sys.argv[1:]):
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse
+import multiprocessing
+import time
+from gunicorn.app.base import BaseApplication
+
+
+class PreforkServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import app
+        return app.app
+
+
+def on_starting(server):
+    from database import get_db, close_client
+    from indexes import ensure_indexes
+    from complaints import ensure_schema
+
+    started = time.perf_counter()
+    try:
+        ensure_schema(get_db())
+        ensure_indexes(get_db())
+        server.log.info(f'Schema and indexes ensured in {(time.perf_counter() - started) * 1000:.1f} ms')
+    except Exception as e:
+        server.log.warning(f'Could not ensure indexes, run "python indexes.py": {str(e)}')
+    finally:
+        close_client()
+
+
+def post_fork(server, worker):
+    from database import close_client
+    # Drop any client inherited from the master; the worker creates its own lazily
+    close_client()
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the API with pre-forked workers')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', 4)))
+    parser.add_argument('--bind', default=os.getenv('BIND', '0.0.0.0:5000'))
+    # gevent holds long-lived event streams far more cheaply than threads
+    parser.add_argument('--worker-class', default=os.getenv('WEB_WORKER_CLASS', 'gthread'),
+                        help='gthread, or gevent when serving many event streams (pip install gevent)')
+    parser.add_argument('--worker-connections', type=int,
+                        default=int(os.getenv('WEB_WORKER_CONNECTIONS', 1000)),
+                        help='open connections per gevent worker')
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('WEB_TIMEOUT', 30)))
+    args = parser.parse_args()
+
+    # Leave most threads or connections for regular requests; set before the app is imported
+    if args.worker_class == 'gevent':
+        os.environ.setdefault('EVENTS_MAX_STREAMS', str(max(1, args.worker_connections * 3 // 4)))
+    else:
+        os.environ.setdefault('EVENTS_MAX_STREAMS', str(max(1, args.threads // 2)))
+
+    PreforkServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': args.worker_class,
+        'worker_connections': args.worker_connections,
+        'timeout': args.timeout,
+        'preload_app': True,
+        'on_starting': on_starting,
+        'post_fork': post_fork,
+        'child_exit': child_exit,
+        'accesslog': '-',
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
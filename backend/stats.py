@@ -0,0 +1,128 @@
+"""Materialized complaint counters.
+
+A single document in ``complaint_stats`` holds totals by status, by type
+and by day. Writers keep it current with ``$inc``; the stats endpoint reads
+it through a short in-process TTL cache.
+
+    python stats.py --rebuild   # recompute the counters from the complaints collection
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from archive import ARCHIVE_COLLECTION
+
+STATS_ID = 'complaints'
+CACHE_TTL_SECONDS = float(os.getenv('STATS_CACHE_TTL_SECONDS', 5))
+
+_cache = {'value': None, 'expires_at': 0}
+_cache_lock = threading.Lock()
+
+
+def _key(value):
+    """Make a status/type value safe to use as a field name."""
+    return str(value).replace('.', '_').lstrip('$') or '_'
+
+
+def _day(created_at):
+    return created_at.strftime('%Y-%m-%d')
+
+
+def record_submission(db, complaint):
+    """Count a newly inserted complaint."""
+    record_submissions(db, [complaint])
+
+
+def record_submissions(db, complaints):
+    """Count a batch of newly inserted complaints with a single update."""
+    if not complaints:
+        return
+    increments = {'total': len(complaints)}
+    for complaint in complaints:
+        for field in (f"by_status.{_key(complaint['status'])}",
+                      f"by_type.{_key(complaint['complaintType'])}",
+                      f"by_day.{_day(complaint['created_at'])}"):
+            increments[field] = increments.get(field, 0) + 1
+    db.complaint_stats.update_one({'_id': STATS_ID}, {'$inc': increments}, upsert=True)
+
+
+def record_status_change(db, old_status, new_status):
+    """Move one complaint from ``old_status`` to ``new_status``."""
+    record_status_changes(db, [(old_status, new_status)])
+
+
+def record_status_changes(db, transitions):
+    """Apply several ``(old_status, new_status)`` moves with a single update."""
+    increments = {}
+    for old_status, new_status in transitions:
+        if old_status == new_status:
+            continue
+        for field, delta in ((f'by_status.{_key(old_status)}', -1), (f'by_status.{_key(new_status)}', 1)):
+            increments[field] = increments.get(field, 0) + delta
+    increments = {field: delta for field, delta in increments.items() if delta}
+    if increments:
+        db.complaint_stats.update_one({'_id': STATS_ID}, {'$inc': increments}, upsert=True)
+
+
+def rebuild_stats(db):
+    """Recompute the counters from scratch and replace the stored document.
+
+    Submissions that land while the aggregation runs may be missed or double
+    counted, so run this during a quiet period.
+    """
+    def group(expression):
+        counts = {}
+        for collection in (db.complaints, db[ARCHIVE_COLLECTION]):
+            for row in collection.aggregate([{'$group': {'_id': expression, 'count': {'$sum': 1}}}]):
+                if row['_id'] is not None:
+                    counts[row['_id']] = counts.get(row['_id'], 0) + row['count']
+        return counts
+
+    by_status = group('$status')
+    document = {
+        '_id': STATS_ID,
+        'total': sum(by_status.values()),
+        'by_status': {_key(k): v for k, v in by_status.items()},
+        'by_type': {_key(k): v for k, v in group('$complaintType').items()},
+        'by_day': group({'$dateToString': {'format': '%Y-%m-%d', 'date': '$created_at'}}),
+        'rebuilt_at': datetime.utcnow()
+    }
+    db.complaint_stats.replace_one({'_id': STATS_ID}, document, upsert=True)
+    invalidate_cache()
+    return document
+
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache['value'] = None
+        _cache['expires_at'] = 0
+
+
+def get_stats(db):
+    """Return the counters document, served from cache for CACHE_TTL_SECONDS."""
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache['value'] is not None and now < _cache['expires_at']:
+            return _cache['value']
+
+    document = db.complaint_stats.find_one({'_id': STATS_ID})
+    if document is None:
+        # First read on a deployment that predates the counters
+        document = rebuild_stats(db)
+
+    with _cache_lock:
+        _cache['value'] = document
+        _cache['expires_at'] = now + CACHE_TTL_SECONDS
+    return document
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+
+    if '--rebuild' not in sys.argv:
+        print('Usage: python stats.py --rebuild')
+        sys.exit(1)
+    db = get_db()
+    stats = rebuild_stats(db)
+    print(f"Rebuilt complaint stats: {stats['total']} complaints")